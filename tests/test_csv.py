@@ -0,0 +1,63 @@
+import os
+
+from zalfmas_common import csv as mas_csv
+
+CSV = "\n".join(
+    [
+        "id;name;crop",
+        "3;c;wheat",
+        "1;a;maize",
+        "2;b;barley",
+        "1;a2;rye",
+    ]
+)
+
+
+def write_csv(path, content=CSV):
+    path.write_text(content + "\n")
+    return path
+
+
+def test_csv_key_index_lookup_matches_read_csv(tmp_path):
+    path = write_csv(tmp_path / "setups.csv")
+    index = mas_csv.CsvKeyIndex(path)
+
+    rows = index.lookup([1, 2, 3, 4, "1"])
+
+    assert rows == mas_csv.read_csv(path)
+    assert len(index) == 3
+    assert 2 in index
+    assert "2" not in index
+
+
+def test_csv_key_index_lookup_with_composite_keys(tmp_path):
+    path = write_csv(tmp_path / "setups.csv")
+    index = mas_csv.CsvKeyIndex(path, key=("id", "name"), key_type=(int, str))
+
+    rows = index.lookup([(1, "a2"), (1, "a"), (1, "a22"), (3, "b")])
+
+    assert list(rows.keys()) == [(1, "a"), (1, "a2")]
+    assert rows[(1, "a2")]["crop"] == "rye"
+    assert sorted(index.keys()) == [(1, "a"), (1, "a2"), (2, "b"), (3, "c")]
+
+
+def test_csv_key_index_is_stored_without_pickle_and_reused(tmp_path):
+    path = write_csv(tmp_path / "setups.csv")
+    mas_csv.CsvKeyIndex(path, index_dir=tmp_path / "index")
+
+    index = mas_csv.CsvKeyIndex(path, index_dir=tmp_path / "index")
+
+    assert sorted(p.suffix for p in (tmp_path / "index").iterdir()) == [".json", ".npy", ".npy"]
+    assert index.lookup([2]) == {2: {"id": 2, "name": "b", "crop": "barley"}}
+
+
+def test_csv_key_index_is_rebuilt_when_csv_file_changes(tmp_path):
+    path = write_csv(tmp_path / "setups.csv")
+    mas_csv.CsvKeyIndex(path)
+
+    write_csv(path, CSV + "\n7;g;oat")
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    index = mas_csv.CsvKeyIndex(path)
+
+    assert index.lookup([7]) == {7: {"id": 7, "name": "g", "crop": "oat"}}
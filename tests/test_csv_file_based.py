@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+
+from zalfmas_common.climate import csv_file_based as cfb
+
+CSV = "\n".join(
+    [
+        "iso-date,tavg,precip",
+        "-,C,mm",
+        "2000-01-01,1.5,0.0",
+        "2000-01-02,2.5,1.0",
+        "2000-01-03,3.5,2.0",
+    ]
+)
+
+
+def timeseries(csv_string=CSV):
+    return cfb.TimeSeries.from_csv_string(csv_string, pandas_csv_config={"skiprows": [1]})
+
+
+def dataframe_bytes():
+    return cfb.dataframe_nbytes(timeseries().dataframe)
+
+
+def test_timeseries_cache_evicts_least_recently_used_dataframe():
+    cache = cfb.TimeSeriesCache(max_bytes=2 * dataframe_bytes())
+    a, b, c = timeseries(), timeseries(), timeseries()
+    for key, ts in zip("abc", [a, b, c]):
+        cache.put(key, ts)
+
+    a.dataframe
+    b.dataframe
+    a.dataframe
+    c.dataframe
+
+    assert b._df is None
+    assert a._df is not None and c._df is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 2 * dataframe_bytes()
+
+
+def test_timeseries_cache_counts_dataframes_reloaded_after_eviction():
+    cache = cfb.TimeSeriesCache(max_bytes=2 * dataframe_bytes())
+    a, b, c = timeseries(), timeseries(), timeseries()
+    for key, ts in zip("abc", [a, b, c]):
+        cache.put(key, ts)
+    a.dataframe
+    b.dataframe
+    c.dataframe
+    assert a._df is None
+
+    # reloaded through a reference held outside the cache, a is accounted for again and b is evicted now
+    assert a.dataframe["tavg"].tolist() == [1.5, 2.5, 3.5]
+
+    assert b._df is None
+    assert a._df is not None and c._df is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["bytes"] == 2 * dataframe_bytes()
+    assert cache.get("a") is a
+
+
+def test_timeseries_cache_access_through_held_reference_counts_as_use():
+    cache = cfb.TimeSeriesCache(max_bytes=2 * dataframe_bytes())
+    a, b, c = timeseries(), timeseries(), timeseries()
+    for key, ts in zip("abc", [a, b, c]):
+        cache.put(key, ts)
+    a.dataframe
+    b.dataframe
+
+    a.dataframe
+    c.dataframe
+
+    assert a._df is not None
+    assert b._df is None
+
+
+def test_timeseries_cache_doesnt_account_replaced_timeseries():
+    cache = cfb.TimeSeriesCache()
+    old, new = timeseries(), timeseries()
+    cache.put("a", old)
+    cache.put("a", new)
+
+    old.dataframe
+
+    assert cache.stats()["bytes"] == 0
+    new.dataframe
+    assert cache.stats()["bytes"] == dataframe_bytes()
+
+
+def test_binary_cache_is_keyed_by_transform_state(tmp_path):
+    path_to_csv = tmp_path / "a.csv"
+    path_to_csv.write_text(CSV)
+
+    def load(factor):
+        return cfb.TimeSeries.from_csv_file(
+            str(path_to_csv),
+            pandas_csv_config={"skiprows": [1]},
+            transform_map={"tavg": lambda v: v * factor},
+            binary_cache_dir=tmp_path / "cache",
+        ).dataframe
+
+    assert load(1)["tavg"].tolist() == [1.5, 2.5, 3.5]
+    assert load(1)["tavg"].dtype == np.float32
+    assert load(2)["tavg"].tolist() == [3.0, 5.0, 7.0]
+
+
+def test_binary_cache_is_rebuilt_when_csv_file_changes(tmp_path):
+    path_to_csv = tmp_path / "a.csv"
+    path_to_csv.write_text(CSV)
+
+    def load():
+        return cfb.TimeSeries.from_csv_file(
+            str(path_to_csv), pandas_csv_config={"skiprows": [1]}, binary_cache_dir=tmp_path / "cache"
+        ).dataframe
+
+    load()
+    path_to_csv.write_text(CSV.replace("1.5", "9.5"))
+    st = path_to_csv.stat()
+    os.utime(path_to_csv, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    assert load()["tavg"].tolist() == [9.5, 2.5, 3.5]
@@ -0,0 +1,204 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from zalfmas_common import rect_ascii_grid_management as ragm
+
+METADATA = {"ncols": 3, "nrows": 2, "xllcorner": 0, "yllcorner": 0, "cellsize": 1, "nodata_value": -9999}
+
+
+def write_grid(path, grid, metadata=METADATA):
+    ragm.write_ascii_grid(path, np.asarray(grid), metadata)
+    return str(path)
+
+
+def touch_later(path):
+    # make sure the changed file is detected, even if it has been rewritten within the mtime resolution
+    st = Path(path).stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def test_grid_cache_evicts_least_recently_used_grid(tmp_path):
+    paths = [write_grid(tmp_path / f"{name}.asc", np.full((2, 3), i)) for i, name in enumerate("abc")]
+    nbytes = np.zeros((2, 3), dtype=int).nbytes
+    cache = ragm.GridCache(max_bytes=2 * nbytes)
+
+    cache.get(paths[0], int)
+    cache.get(paths[1], int)
+    cache.get(paths[0], int)
+    cache.get(paths[2], int)
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 2 * nbytes
+    assert cache.get(paths[0], int)["grid"][0, 0] == 0
+    assert cache.stats()["misses"] == 3
+    cache.get(paths[1], int)
+    assert cache.stats()["misses"] == 4
+
+
+def test_grid_cache_loads_once_for_concurrent_callers(tmp_path, monkeypatch):
+    path = write_grid(tmp_path / "a.asc", np.arange(6).reshape(2, 3))
+    loads = []
+    create = ragm._create_grid_cache_entry
+
+    def counting_create(*args, **kwargs):
+        loads.append(args[0])
+        return create(*args, **kwargs)
+
+    monkeypatch.setattr(ragm, "_create_grid_cache_entry", counting_create)
+    cache = ragm.GridCache()
+    entries = []
+    threads = [threading.Thread(target=lambda: entries.append(cache.get(path, int))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+    assert all(entry is entries[0] for entry in entries)
+
+
+def test_grid_cache_drops_load_invalidated_while_in_flight(tmp_path, monkeypatch):
+    path = write_grid(tmp_path / "a.asc", np.arange(6).reshape(2, 3))
+    loading = threading.Event()
+    proceed = threading.Event()
+    create = ragm._create_grid_cache_entry
+
+    def slow_create(*args, **kwargs):
+        loading.set()
+        assert proceed.wait(10)
+        return create(*args, **kwargs)
+
+    monkeypatch.setattr(ragm, "_create_grid_cache_entry", slow_create)
+    cache = ragm.GridCache()
+    t = threading.Thread(target=cache.get, args=(path, int))
+    t.start()
+    assert loading.wait(10)
+    cache.invalidate(path)
+    proceed.set()
+    t.join()
+
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_load_grid_cached_uses_binary_cache_setting_of_grid_cache(tmp_path, monkeypatch):
+    path = write_grid(tmp_path / "a.asc", np.arange(6).reshape(2, 3))
+    cache = ragm.GridCache(use_binary_cache=True, cache_dir=tmp_path / "cache")
+    monkeypatch.setattr(ragm, "grid_cache", cache)
+
+    ragm.load_grid_cached(path, int)
+
+    assert list((tmp_path / "cache").glob("*.npy"))
+
+
+def test_binary_cache_is_rebuilt_when_grid_file_changes(tmp_path):
+    path = write_grid(tmp_path / "a.asc", np.zeros((2, 3), dtype=int))
+    cache_dir = tmp_path / "cache"
+    ragm.load_grid_and_metadata_from_ascii_grid(path, use_binary_cache=True, cache_dir=cache_dir)
+    grid, _ = ragm.load_grid_and_metadata_from_ascii_grid(path, use_binary_cache=True, cache_dir=cache_dir)
+    assert isinstance(grid, np.memmap)
+
+    write_grid(path, np.ones((2, 3), dtype=int))
+    touch_later(path)
+    grid, _ = ragm.load_grid_and_metadata_from_ascii_grid(path, use_binary_cache=True, cache_dir=cache_dir)
+
+    assert (grid == 1).all()
+
+
+def test_binary_cache_is_keyed_by_dtype(tmp_path):
+    path = write_grid(tmp_path / "a.asc", np.arange(6).reshape(2, 3))
+    cache_dir = tmp_path / "cache"
+    ragm.load_grid_and_metadata_from_ascii_grid(path, datatype=int, use_binary_cache=True, cache_dir=cache_dir)
+
+    grid, _ = ragm.load_grid_and_metadata_from_ascii_grid(
+        path, datatype=float, use_binary_cache=True, cache_dir=cache_dir
+    )
+
+    assert grid.dtype == np.float64
+
+
+def test_grid_stack_file_is_keyed_by_dtype(tmp_path):
+    path = write_grid(tmp_path / "a.asc", np.arange(6).reshape(2, 3))
+    stack_file = tmp_path / "stack.npy"
+
+    int_stack = ragm.GridStack.from_ascii_grids({"a": path}, datatype=int, path_to_stack_file=stack_file)
+    float_stack = ragm.GridStack.from_ascii_grids({"a": path}, datatype=float, path_to_stack_file=stack_file)
+    reused_stack = ragm.GridStack.from_ascii_grids({"a": path}, datatype=float, path_to_stack_file=stack_file)
+
+    assert int_stack.grids.dtype == np.int64
+    assert float_stack.grids.dtype == np.float64
+    assert reused_stack.grids.dtype == np.float64
+    assert (reused_stack["a"] == np.arange(6).reshape(2, 3)).all()
+
+
+def test_grid_stack_file_is_rebuilt_when_grid_file_changes(tmp_path):
+    path = write_grid(tmp_path / "a.asc", np.zeros((2, 3), dtype=int))
+    stack_file = tmp_path / "stack.npy"
+    ragm.GridStack.from_ascii_grids({"a": path}, path_to_stack_file=stack_file)
+
+    write_grid(path, np.ones((2, 3), dtype=int))
+    touch_later(path)
+    stack = ragm.GridStack.from_ascii_grids({"a": path}, path_to_stack_file=stack_file)
+
+    assert (stack["a"] == 1).all()
+
+
+def _scaled_transform(factor):
+    return lambda rs, hs: (rs * factor, hs * factor)
+
+
+def test_interpolator_index_is_keyed_by_transform_state(tmp_path):
+    grid = np.arange(6).reshape(2, 3)
+    index_path = tmp_path / "index.pickle"
+
+    interpolator, _ = ragm.create_interpolator_from_rect_grid(
+        grid, METADATA, transform_func=_scaled_transform(1), index_cache_path=index_path
+    )
+    assert interpolator(2, 1) == 2
+    interpolator, _ = ragm.create_interpolator_from_rect_grid(
+        grid, METADATA, transform_func=_scaled_transform(10), index_cache_path=index_path
+    )
+
+    # (2, 1) is closest to the lower left cell center (0, 0) once the points are scaled by 10
+    assert interpolator(2, 1) == 3
+
+
+def test_interpolator_index_is_keyed_by_grid_values(tmp_path):
+    index_path = tmp_path / "index.pickle"
+    ragm.create_interpolator_from_rect_grid(np.zeros((2, 3), dtype=int), METADATA, index_cache_path=index_path)
+
+    interpolator, _ = ragm.create_interpolator_from_rect_grid(
+        np.ones((2, 3), dtype=int), METADATA, index_cache_path=index_path
+    )
+
+    assert interpolator(0.5, 0.5) == 1
+
+
+def test_interpolator_index_needs_explicit_key_for_unstable_transform(tmp_path):
+    class Scaler:
+        def transform(self, rs, hs):
+            return rs, hs
+
+    with pytest.raises(ValueError, match="index_cache_key"):
+        ragm.create_interpolator_from_rect_grid(
+            np.zeros((2, 3), dtype=int),
+            METADATA,
+            transform_func=Scaler().transform,
+            index_cache_path=tmp_path / "index.pickle",
+        )
+
+
+def test_ascii_grid_writer_round_trips_integer_grids(tmp_path):
+    path = tmp_path / "a.asc"
+    with ragm.AsciiGridWriter(path, METADATA) as writer:
+        writer.write_rows(np.array([1, 2, -9999]))
+        writer.write_rows(np.array([[4, 5, 6]]))
+
+    grid, _ = ragm.read_ascii_grid(path, datatype=int)
+
+    assert grid.tolist() == [[1, 2, -9999], [4, 5, 6]]
@@ -18,10 +18,10 @@ from datetime import date
 
 import numpy as np
 from mas.schema.climate import climate_capnp
-from pyproj import CRS
 from scipy.interpolate import NearestNDInterpolator
 
 from zalfmas_common import common
+from zalfmas_common import crs_registry as crsr
 from zalfmas_common import rect_ascii_grid_management as ragm
 from zalfmas_common import service as serv
 
@@ -40,11 +40,11 @@ def read_header(path_to_ascii_grid_file):
     return metadata, header_str
 
 
-def read_file_and_create_interpolator(path_to_grid, dtype=int, skiprows=6, confirm_creation=False):
-    """read file and metadata and create interpolator"""
+def read_file_and_create_interpolator(path_to_grid, dtype=int, skiprows=None, confirm_creation=False):
+    """read file and metadata and create interpolator
+    skiprows - number of header lines, detected if None"""
 
-    metadata, _ = ragm.read_header(path_to_grid)
-    grid = np.loadtxt(path_to_grid, dtype=dtype, skiprows=skiprows)
+    grid, metadata = ragm.read_ascii_grid(path_to_grid, datatype=dtype, no_of_header_lines=skiprows)
     interpolate = ragm.create_interpolator_from_rect_grid(grid, metadata)
     if confirm_creation:
         print("created interpolator from:", path_to_grid)
@@ -52,42 +52,42 @@ def read_file_and_create_interpolator(path_to_grid, dtype=int, skiprows=6, confi
 
 
 def name_to_crs(name):
-    if not hasattr(name_to_crs, "d"):
-        name_to_crs.d = {
-            "latlon": CRS.from_epsg(4326),
-            "wgs84": CRS.from_epsg(4326),
-            "gk3": CRS.from_epsg(3396),
-            "gk5": CRS.from_epsg(31469),
-            "utm21s": CRS.from_epsg(32721),
-            "utm32n": CRS.from_epsg(25832),
-        }
-    return name_to_crs.d.get(name, None)
+    return crsr.crs_for_name(name)
 
 
-def create_lat_lon_interpolator_from_json_coords_file(path_to_json_coords_file):
+def create_lat_lon_interpolator_from_json_coords_file(
+    path_to_json_coords_file, use_index_cache=False, index_cache_dir=None
+):
     """
     create interpolator from json list of lat/lon to row/col mappings and return rowcol to latlon dict
+    use_index_cache - store interpolator and dict in the user's private cache directory (or in index_cache_dir)
+                      and load them from there on later calls
     """
 
-    cdict = {}
-    with open(path_to_json_coords_file) as _:
-        points = []
-        values = []
-
-        for latlon, rowcol in json.load(_):
-            row, col = rowcol
-            lat, lon = latlon
-            # alt = float(line[3])
-            cdict[(row, col)] = {
-                "lat": round(lat, 5),
-                "lon": round(lon, 5),
-                "alt": -9999,
-            }
-            points.append([lat, lon])
-            values.append((row, col))
-            # print("row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i])
-
-        return (NearestNDInterpolator(np.array(points), np.array(values)), cdict)
+    def create():
+        cdict = {}
+        with open(path_to_json_coords_file) as _:
+            points = []
+            values = []
+
+            for latlon, rowcol in json.load(_):
+                row, col = rowcol
+                lat, lon = latlon
+                # alt = float(line[3])
+                cdict[(row, col)] = {
+                    "lat": round(lat, 5),
+                    "lon": round(lon, 5),
+                    "alt": -9999,
+                }
+                points.append([lat, lon])
+                values.append((row, col))
+                # print("row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i])
+
+            return (NearestNDInterpolator(np.array(points), np.array(values)), cdict)
+
+    if use_index_cache:
+        return ragm.load_or_create_interpolator_index(path_to_json_coords_file, None, create, index_cache_dir)
+    return create()
 
 
 def lat_lon_interpolator(path_to_latlon_to_rowcol_json_file):
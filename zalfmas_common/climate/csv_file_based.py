@@ -13,12 +13,20 @@
 #
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
+import asyncio
 import gzip
+import hashlib
 import io
 import itertools
-from collections import OrderedDict, deque
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
 from datetime import date
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import psutil
 from mas.schema.climate import climate_capnp
@@ -26,6 +34,156 @@ from mas.schema.geo import geo_capnp
 
 from zalfmas_common import common
 from zalfmas_common.climate import common_climate_data_capnp_impl as ccdi
+from zalfmas_common.file_utils import atomic_write, callable_key, save_npy_and_json
+
+logger = logging.getLogger(__name__)
+
+PANDAS_CSV_CONFIG_DEFAULTS = {"skiprows": [0], "index_col": 0, "sep": ","}
+
+
+def _days_since(start, datetime_index):
+    return ((datetime_index - start) // pd.Timedelta(days=1)).to_numpy(dtype=np.int32)
+
+
+def _encode_daily_index(index):
+    """describe a date index (DatetimeIndex or ISO date strings) by start date and day offsets,
+    None if it can't be rebuilt exactly from that"""
+    try:
+        if isinstance(index, pd.DatetimeIndex):
+            index_kind = "datetime"
+            datetime_index = index
+        else:
+            index_kind = "iso-date"
+            datetime_index = pd.DatetimeIndex(pd.to_datetime(index, format="%Y-%m-%d"))
+    except (ValueError, TypeError):
+        return None
+    start = datetime_index[0].normalize()
+    offsets = _days_since(start, datetime_index)
+    rebuilt = start + pd.to_timedelta(offsets, unit="D")
+    if index_kind == "datetime" and not rebuilt.equals(index):
+        return None
+    if index_kind == "iso-date" and list(rebuilt.strftime("%Y-%m-%d")) != list(index):
+        return None
+    return {
+        "index_kind": index_kind,
+        "index_name": index.name,
+        "start": start.isoformat(),
+        "offsets": None if np.array_equal(offsets, np.arange(len(offsets))) else offsets.tolist(),
+    }
+
+
+def _decode_daily_index(info, length):
+    """rebuild the date index described by _encode_daily_index"""
+    start = pd.Timestamp(info["start"])
+    offsets = np.arange(length) if info["offsets"] is None else np.asarray(info["offsets"])
+    dates = start + pd.to_timedelta(offsets, unit="D")
+    index = pd.DatetimeIndex(dates) if info["index_kind"] == "datetime" else pd.Index(dates.strftime("%Y-%m-%d"))
+    index.name = info["index_name"]
+    return index
+
+
+def _all_numeric(df):
+    return all(pd.api.types.is_numeric_dtype(dt) for dt in df.dtypes)
+
+
+def _timeseries_config_key(pandas_csv_config, header_map, supported_headers, transform_map):
+    """everything besides the csv file itself which determines the dataframe of a time series"""
+    return {
+        "pandas_csv_config": json.dumps(pandas_csv_config, sort_keys=True, default=str),
+        "header_map": json.dumps(header_map, sort_keys=True, default=str),
+        "supported_headers": json.dumps(supported_headers, default=str),
+        "transform_map": {
+            str(col_name): callable_key(trans_func) for col_name, trans_func in (transform_map or {}).items()
+        },
+    }
+
+
+def _binary_timeseries_cache_paths(cache_dir, path_to_csv, config_key):
+    key_str = json.dumps([str(Path(path_to_csv).resolve()), config_key])
+    key_hash = hashlib.sha1(key_str.encode()).hexdigest()
+    base = Path(cache_dir) / f"{Path(path_to_csv).name}.{key_hash[:16]}"
+    return base.with_name(base.name + ".npy"), base.with_name(base.name + ".json")
+
+
+def _binary_timeseries_cache_key(path_to_csv, config_key):
+    path = Path(path_to_csv).resolve()
+    st = path.stat()
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "config": config_key}
+
+
+def load_dataframe_from_binary_cache(cache_dir, path_to_csv, config_key):
+    """load a time series stored with save_dataframe_to_binary_cache, None if there is no valid cache entry"""
+    npy_path, json_path = _binary_timeseries_cache_paths(cache_dir, path_to_csv, config_key)
+    try:
+        with json_path.open() as _:
+            info = json.load(_)
+        if info["key"] != _binary_timeseries_cache_key(path_to_csv, config_key):
+            return None
+        data = np.load(npy_path)
+        index = _decode_daily_index(info, len(data))
+        return pd.DataFrame(data, index=index, columns=info["columns"], copy=False)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _binary_cache_index_info(df):
+    """the encoded date index of df if it can be stored in the binary cache, else None"""
+    if len(df) == 0 or not _all_numeric(df):
+        return None
+    return _encode_daily_index(df.index)
+
+
+def save_dataframe_to_binary_cache(cache_dir, path_to_csv, config_key, df):
+    """store the daily time series df as float32 matrix (.npy) plus columns and day offset index (.json),
+    returns False if df can't be represented that way (non numeric columns or non daily date index)"""
+    index_info = _binary_cache_index_info(df)
+    if index_info is None:
+        return False
+
+    npy_path, json_path = _binary_timeseries_cache_paths(cache_dir, path_to_csv, config_key)
+    info = {
+        "key": _binary_timeseries_cache_key(path_to_csv, config_key),
+        "columns": [str(c) for c in df.columns],
+        **index_info,
+    }
+    try:
+        save_npy_and_json(npy_path, json_path, df.to_numpy(dtype=np.float32), info)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't write binary cache for time series %s: %s", path_to_csv, e)
+        return False
+    return True
+
+
+def read_timeseries_csv(
+    path_to_csv=None,
+    csv_string=None,
+    header_map=None,
+    supported_headers=None,
+    pandas_csv_config=None,
+    transform_map=None,
+):
+    """read a climate time series csv file (or string) into a dataframe
+    and apply header mapping, header reduction and column transformations"""
+    if path_to_csv and path_to_csv[-2:] == "gz":
+        with gzip.open(path_to_csv) as _:
+            df = pd.read_csv(_, **pandas_csv_config)
+    elif path_to_csv:
+        df = pd.read_csv(path_to_csv, **pandas_csv_config)
+    else:
+        df = pd.read_csv(io.StringIO(csv_string), **pandas_csv_config)
+
+    if header_map:
+        df.rename(columns=header_map, inplace=True)
+
+    # reduce headers to the supported ones
+    if supported_headers:
+        df = df.loc[:, df.columns.intersection(supported_headers)]
+
+    if transform_map:
+        for col_name, trans_func in transform_map.items():
+            df[col_name] = df[col_name].map(trans_func)
+
+    return df
 
 
 class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Persistable):
@@ -44,6 +202,7 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
         name=None,
         description=None,
         restorer=None,
+        binary_cache_dir=None,
     ):
         common.Persistable.__init__(self, restorer)
         common.Identifiable.__init__(self, id, name, description)
@@ -68,12 +227,20 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
         self._supported_headers = (
             list(climate_capnp.Element.schema.enumerants.keys()) if supported_headers is None else supported_headers
         )
-        self._pandas_csv_config_defaults = {"skiprows": [0], "index_col": 0, "sep": ","}
+        self._pandas_csv_config_defaults = PANDAS_CSV_CONFIG_DEFAULTS
         self._pandas_csv_config = {
             **self._pandas_csv_config_defaults,
             **pandas_csv_config,
         }
         self._transform_map = transform_map
+        # if set, csv files are parsed once and then loaded from a binary (float32) cache in this directory
+        self._binary_cache_dir = binary_cache_dir
+        # called as f(df, loaded) on every access of the dataframe, loaded is True if it has just been loaded
+        # (used for the recency and byte accounting of TimeSeriesCache)
+        self._on_dataframe_used = None
+        # concurrent first accesses of the dataframe share a single load
+        self._load_lock = threading.Lock()
+        self._loading_future = None
 
         self._persistence_service = None
 
@@ -91,6 +258,7 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
         name=None,
         description=None,
         restorer=None,
+        binary_cache_dir=None,
     ):
         return TimeSeries(
             metadata=metadata,
@@ -104,6 +272,7 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
             name=name,
             description=description,
             restorer=restorer,
+            binary_cache_dir=binary_cache_dir,
         )
 
     @classmethod
@@ -156,54 +325,92 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
             restorer=restorer,
         )
 
+    def _binary_cache_config_key(self):
+        return _timeseries_config_key(
+            self._pandas_csv_config, self._header_map, self._supported_headers, self._transform_map
+        )
+
     @property
     def dataframe(self):
         """init underlying dataframe lazily if initialized with path to csv file"""
-        if self._df is None and (self._path_to_csv or self._csv_string):
-            # load csv file
-            if self._path_to_csv and self._path_to_csv[-2:] == "gz":
-                with gzip.open(self._path_to_csv) as _:
-                    self._df = pd.read_csv(_, **self._pandas_csv_config)
-            elif self._path_to_csv:
-                self._df = pd.read_csv(self._path_to_csv, **self._pandas_csv_config)
-            else:
-                self._df = pd.read_csv(io.StringIO(self._csv_string), **self._pandas_csv_config)
-
-            if self._header_map:
-                self._df.rename(columns=self._header_map, inplace=True)
-
-            # reduce headers to the supported ones
-            if self._supported_headers:
-                self._df = self._df.loc[:, self._df.columns.intersection(self._supported_headers)]
+        df = self._df
+        loaded = False
+        if df is None:
+            with self._load_lock:
+                df = self._df
+                if df is None:
+                    df = self._df = self._load_dataframe()
+                    loaded = df is not None
+
+        if df is not None and self._on_dataframe_used:
+            self._on_dataframe_used(df, loaded)
+        return df
+
+    async def dataframe_async(self):
+        """like dataframe, but loads it in the default executor of the running event loop,
+        concurrent callers await the same load"""
+        df = self._df
+        if df is not None:
+            if self._on_dataframe_used:
+                self._on_dataframe_used(df, False)
+            return df
+
+        if self._loading_future is None:
+            self._loading_future = asyncio.get_running_loop().run_in_executor(None, lambda: self.dataframe)
+            self._loading_future.add_done_callback(lambda _: setattr(self, "_loading_future", None))
+        return await asyncio.shield(self._loading_future)
+
+    def _load_dataframe(self):
+        df = None
+        use_binary_cache = self._binary_cache_dir is not None and self._path_to_csv is not None
+        if use_binary_cache:
+            df = load_dataframe_from_binary_cache(
+                self._binary_cache_dir, self._path_to_csv, self._binary_cache_config_key()
+            )
 
-            if self._transform_map:
-                for col_name, trans_func in self._transform_map.items():
-                    self._df[col_name] = self._df[col_name].map(trans_func)
+        if df is None and (self._path_to_csv or self._csv_string):
+            # load csv file
+            df = read_timeseries_csv(
+                path_to_csv=self._path_to_csv,
+                csv_string=self._csv_string,
+                header_map=self._header_map,
+                supported_headers=self._supported_headers,
+                pandas_csv_config=self._pandas_csv_config,
+                transform_map=self._transform_map,
+            )
 
-        return self._df
+            if use_binary_cache and _binary_cache_index_info(df) is not None:
+                # serve the same float32 values as all later loads from the binary cache
+                df = df.astype(np.float32)
+                save_dataframe_to_binary_cache(
+                    self._binary_cache_dir, self._path_to_csv, self._binary_cache_config_key(), df
+                )
+        return df
 
     async def resolution(self, **kwargs):  # -> (resolution :TimeResolution);
         return climate_capnp.TimeSeries.Resolution.daily
 
     async def range(self, _context, **kwargs):  # -> (startDate :Date, endDate :Date);
-        _context.results.startDate = ccdi.create_capnp_date(date.fromisoformat(str(self.dataframe.index[0])[:10]))
-        _context.results.endDate = ccdi.create_capnp_date(date.fromisoformat(str(self.dataframe.index[-1])[:10]))
+        df = await self.dataframe_async()
+        _context.results.startDate = ccdi.create_capnp_date(date.fromisoformat(str(df.index[0])[:10]))
+        _context.results.endDate = ccdi.create_capnp_date(date.fromisoformat(str(df.index[-1])[:10]))
 
     async def header(self, **kwargs):  # () -> (header :List(Element));
-        return self.dataframe.columns.tolist()
+        return (await self.dataframe_async()).columns.tolist()
 
     async def data(self, **kwargs):  # () -> (data :List(List(Float32)));
-        return self.dataframe.to_numpy().tolist()
+        return (await self.dataframe_async()).to_numpy().tolist()
 
     async def dataT(self, **kwargs):  # () -> (data :List(List(Float32)));
-        return self.dataframe.T.to_numpy().tolist()
+        return (await self.dataframe_async()).T.to_numpy().tolist()
 
     async def subrange(self, _context, **kwargs):  # (from :Date, to :Date) -> (timeSeries :TimeSeries);
         ps = _context.params
-        start_date = ccdi.create_date(ps.start) if ps._has("start") else self.dataframe.index[0]
-        end_date = ccdi.create_date(ps.end) if ps._has("end") else self.dataframe.index[-1]
+        df = await self.dataframe_async()
+        start_date = ccdi.create_date(ps.start) if ps._has("start") else df.index[0]
+        end_date = ccdi.create_date(ps.end) if ps._has("end") else df.index[-1]
 
-        sub_df = self.dataframe.loc[str(start_date) : str(end_date)]
+        sub_df = df.loc[str(start_date) : str(end_date)]
 
         _context.results.timeSeries = TimeSeries.from_dataframe(
             sub_df,
@@ -216,7 +423,7 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
 
     async def subheader(self, elements, _context, **kwargs):  # (elements :List(Element)) -> (timeSeries :TimeSeries);
         sub_headers = [str(e) for e in elements]
-        sub_df = self.dataframe.loc[:, sub_headers]
+        sub_df = (await self.dataframe_async()).loc[:, sub_headers]
 
         return TimeSeries.from_dataframe(
             sub_df,
@@ -250,6 +457,287 @@ class TimeSeries(climate_capnp.TimeSeries.Server, common.Identifiable, common.Pe
         # print("deleting timeseries:", self.name, "id:", self.__ID)
 
 
+def _climate_cube_paths(path_to_cube):
+    p = Path(path_to_cube)
+    return p.with_suffix(".npy"), p.with_suffix(".json")
+
+
+def rowcols_from_row_col_pattern(path_to_rows, row_col_pattern="row-{row}/col-{col}.csv"):
+    """find all (row, col) cells which have a file matching row_col_pattern below path_to_rows"""
+    glob_pattern = row_col_pattern.replace("{row}", "*").replace("{col}", "*")
+    regex = re.compile(
+        re.escape(row_col_pattern).replace(r"\{row\}", r"(?P<row>\d+)").replace(r"\{col\}", r"(?P<col>\d+)") + "$"
+    )
+    rowcols = []
+    for path in Path(path_to_rows).glob(glob_pattern):
+        m = regex.match(path.relative_to(path_to_rows).as_posix())
+        if m:
+            rowcols.append((int(m["row"]), int(m["col"])))
+    return sorted(rowcols)
+
+
+def create_climate_cube(
+    path_to_rows,
+    path_to_cube,
+    rowcols=None,
+    row_col_pattern="row-{row}/col-{col}.csv",
+    header_map=None,
+    supported_headers=None,
+    pandas_csv_config=None,
+    transform_map=None,
+):
+    """pack the per cell csv files of a dataset into one float32 array (cells x days x elements) at path_to_cube (.npy)
+    plus a .json file with the shared header and dates and the row/col of each cell,
+    all cells have to have the same header and dates, returns the number of cells in the cube
+    the csv parsing configuration is stored with the cube, so a Dataset can check that it's been built the same way"""
+    pandas_csv_config = {**PANDAS_CSV_CONFIG_DEFAULTS, **(pandas_csv_config or {})}
+    if supported_headers is None:
+        supported_headers = list(climate_capnp.Element.schema.enumerants.keys())
+    if rowcols is None:
+        rowcols = rowcols_from_row_col_pattern(path_to_rows, row_col_pattern)
+
+    def path_to_csv(row, col):
+        return f"{path_to_rows}/{row_col_pattern.format(row=row, col=col)}"
+
+    existing_rowcols = []
+    for row, col in rowcols:
+        if Path(path_to_csv(row, col)).exists():
+            existing_rowcols.append((row, col))
+        else:
+            logger.warning("No csv file for row: %s col: %s, cell won't be part of the climate cube", row, col)
+    if len(existing_rowcols) == 0:
+        raise ValueError(f"No csv files found below {path_to_rows}")
+
+    def read_cell(row, col):
+        return read_timeseries_csv(
+            path_to_csv=path_to_csv(row, col),
+            header_map=header_map,
+            supported_headers=supported_headers,
+            pandas_csv_config=pandas_csv_config,
+            transform_map=transform_map,
+        )
+
+    # the first cell determines header and dates of the cube
+    first_df = read_cell(*existing_rowcols[0])
+    if not _all_numeric(first_df):
+        raise ValueError(f"Non numeric columns in {path_to_csv(*existing_rowcols[0])}")
+    index_info = _encode_daily_index(first_df.index)
+    if index_info is None:
+        raise ValueError(f"No daily date index in {path_to_csv(*existing_rowcols[0])}")
+    columns = first_df.columns
+    index = first_df.index
+
+    def write_cube(f):
+        cube = np.lib.format.open_memmap(
+            f.name, mode="w+", dtype=np.float32, shape=(len(existing_rowcols), len(index), len(columns))
+        )
+        for i, (row, col) in enumerate(existing_rowcols):
+            df = first_df if i == 0 else read_cell(row, col)
+            if not (df.columns.equals(columns) and df.index.equals(index)):
+                raise ValueError(f"Header or dates of {path_to_csv(row, col)} differ from the other cells")
+            cube[i] = df.to_numpy(dtype=np.float32)
+            if (i + 1) % 10000 == 0:
+                logger.info("Packed %s of %s cells into climate cube", i + 1, len(existing_rowcols))
+        cube.flush()
+        del cube
+
+    npy_path, json_path = _climate_cube_paths(path_to_cube)
+    atomic_write(npy_path, write_cube)
+    info = {
+        "columns": [str(c) for c in columns],
+        **index_info,
+        "config": _timeseries_config_key(pandas_csv_config, header_map, supported_headers, transform_map),
+        "rowcols": [[row, col] for row, col in existing_rowcols],
+    }
+    atomic_write(json_path, lambda f: json.dump(info, f), mode="w")
+    return len(existing_rowcols)
+
+
+class ClimateCube:
+    """read only access to a climate cube created by create_climate_cube,
+    the data are memory mapped and the time series of a cell are returned as views into the mapping"""
+
+    def __init__(self, path_to_cube):
+        npy_path, json_path = _climate_cube_paths(path_to_cube)
+        with json_path.open() as _:
+            info = json.load(_)
+        self._data = np.load(npy_path, mmap_mode="r")
+        self._columns = pd.Index(info["columns"])
+        self._index = _decode_daily_index(info, self._data.shape[1])
+        self._rowcol_to_offset = {(row, col): i for i, (row, col) in enumerate(info["rowcols"])}
+        # the csv parsing configuration the cube has been built with (None for cubes of older versions)
+        self.config = info.get("config")
+        if len(self._rowcol_to_offset) != self._data.shape[0]:
+            raise ValueError(f"Climate cube {npy_path} doesn't match its index file {json_path}")
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def index(self):
+        return self._index
+
+    def __len__(self):
+        return len(self._rowcol_to_offset)
+
+    def __contains__(self, rowcol):
+        return rowcol in self._rowcol_to_offset
+
+    def rowcols(self):
+        return self._rowcol_to_offset.keys()
+
+    def values_at(self, row: int, col: int):
+        """days x elements array for the cell at row/col (a view into the memory mapped cube)"""
+        return self._data[self._rowcol_to_offset[(row, col)]]
+
+    def dataframe_at(self, row: int, col: int):
+        """dataframe for the cell at row/col, sharing memory with the memory mapped cube"""
+        return pd.DataFrame(self.values_at(row, col), index=self._index, columns=self._columns, copy=False)
+
+
+def dataframe_nbytes(df):
+    """bytes used by the data and index of df"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class TimeSeriesCache:
+    """Thread-safe LRU cache of the TimeSeries of a Dataset.
+    The bytes of the lazily loaded dataframes are accounted for as soon as they are loaded and every access of a
+    dataframe (also through references held elsewhere) counts as use. If the bytes exceed max_bytes (None = unbounded),
+    the least recently used time series are dropped and their dataframes released. A dropped time series which
+    is used again reloads its dataframe and is added to the cache again."""
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        # time series with loaded dataframe in LRU order and their bytes
+        self._entries = OrderedDict()
+        self._entry_bytes = {}
+        # time series which haven't loaded their dataframe yet or got it passed in
+        self._unloaded = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self, keep=None):
+        while self._max_bytes is not None and self.bytes > self._max_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._release(self._remove(key))
+            self.evictions += 1
+
+    def _remove(self, key):
+        if key in self._unloaded:
+            return self._unloaded.pop(key)
+        self.bytes -= self._entry_bytes.pop(key)
+        return self._entries.pop(key)
+
+    @staticmethod
+    def _release(timeseries):
+        # only dataframes which can be loaded again are released
+        if timeseries._path_to_csv or timeseries._csv_string:
+            timeseries._df = None
+
+    def _dataframe_used(self, key, timeseries, df, loaded):
+        with self._lock:
+            if key in self._entries:
+                if self._entries[key] is timeseries:
+                    self._entries.move_to_end(key)
+                return
+            if key in self._unloaded:
+                # dataframes passed in directly don't count against the budget
+                if self._unloaded[key] is not timeseries or not loaded:
+                    return
+                del self._unloaded[key]
+            elif not loaded:
+                # just released by an eviction, the next access will reload and re-add it
+                return
+            # loaded for the first time or reloaded after it had been evicted
+            nbytes = dataframe_nbytes(df)
+            self._entries[key] = timeseries
+            self._entry_bytes[key] = nbytes
+            self.bytes += nbytes
+            self._evict(keep=key)
+
+    def _get_cached(self, key):
+        timeseries = self._entries.get(key)
+        if timeseries is not None:
+            self._entries.move_to_end(key)
+        else:
+            timeseries = self._unloaded.get(key)
+        if timeseries is not None:
+            self.hits += 1
+        return timeseries
+
+    def get(self, key):
+        """return the cached TimeSeries for key or None"""
+        with self._lock:
+            timeseries = self._get_cached(key)
+            if timeseries is None:
+                self.misses += 1
+            return timeseries
+
+    def get_or_put(self, key, create_timeseries):
+        """return the cached TimeSeries for key or cache and return the one created by create_timeseries(),
+        concurrent callers for the same key get the same TimeSeries (creating it must be cheap, it loads lazily)"""
+        with self._lock:
+            timeseries = self._get_cached(key)
+            if timeseries is not None:
+                return timeseries
+            self.misses += 1
+            timeseries = create_timeseries()
+            self._put(key, timeseries)
+            return timeseries
+
+    def put(self, key, timeseries: TimeSeries):
+        """cache timeseries under key, its dataframe is accounted for when it gets loaded"""
+        with self._lock:
+            self._put(key, timeseries)
+
+    def _put(self, key, timeseries):
+        if key in self._unloaded or key in self._entries:
+            self._remove(key)
+        self._unloaded[key] = timeseries
+        timeseries._on_dataframe_used = lambda df, loaded: self._dataframe_used(key, timeseries, df, loaded)
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._unloaded or key in self._entries:
+                self._release(self._remove(key))
+
+    def clear(self):
+        with self._lock:
+            for timeseries in self._entries.values():
+                self._release(timeseries)
+            self._entries.clear()
+            self._entry_bytes.clear()
+            self._unloaded.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self.bytes,
+                "entries": len(self._entries) + len(self._unloaded),
+            }
+
+
 class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persistable):
     def __init__(
         self,
@@ -269,6 +757,9 @@ class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persista
         restorer=None,
         percentage_of_main_memory_use=20,
         cache_data=True,
+        binary_cache_dir=None,
+        climate_cube=None,
+        max_cache_bytes=None,
     ):
         common.Persistable.__init__(self, restorer)
         common.Identifiable.__init__(self, id, name, description)
@@ -276,8 +767,6 @@ class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persista
         self._meta = metadata
         self._path_to_rows = path_to_rows
         self._interpolator = interpolator
-        self._timeseries = {}
-        self._creation_order = deque()
         self._locations = {}
         self._all_locations_created = False
         self._header_map = header_map
@@ -286,9 +775,28 @@ class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persista
         self._row_col_pattern = row_col_pattern
         self._pandas_csv_config = pandas_csv_config
         self._transform_map = transform_map
-        self._process = psutil.Process()
-        self._percentage_of_main_memory_use = percentage_of_main_memory_use
+        # the loaded time series may use max_cache_bytes, by default percentage_of_main_memory_use of the main memory
+        if max_cache_bytes is None:
+            max_cache_bytes = psutil.virtual_memory().total * percentage_of_main_memory_use // 100
+        self._timeseries_cache = TimeSeriesCache(max_bytes=max_cache_bytes)
         self._cache_data = cache_data
+        self._binary_cache_dir = binary_cache_dir
+        # cells found in the (path to a) ClimateCube are served from it, all others from their csv files
+        self._climate_cube = ClimateCube(climate_cube) if isinstance(climate_cube, (str, Path)) else climate_cube
+        if self._climate_cube is not None:
+            config = _timeseries_config_key(
+                {**PANDAS_CSV_CONFIG_DEFAULTS, **pandas_csv_config},
+                header_map,
+                list(climate_capnp.Element.schema.enumerants.keys())
+                if supported_headers is None
+                else supported_headers,
+                transform_map,
+            )
+            if self._climate_cube.config != config:
+                raise ValueError(
+                    "The climate cube has been built with another csv configuration (pandas_csv_config, header_map, "
+                    "supported_headers or transform_map) than the one of this dataset."
+                )
 
     async def metadata_context(self, context):  # metadata @0 () -> Metadata;
         # get metadata for these data
@@ -299,10 +807,26 @@ class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persista
         r.info = self._meta.info
 
     def timeseries_at(self, row: int, col: int, location=None):
-        if not self._cache_data or (row, col) not in self._timeseries:
+        # cells of the climate cube aren't cached, their dataframes are cheap views into the memory mapped cube
+        # and caching them would only accumulate wrapper objects outside the byte budget of the cache
+        in_climate_cube = self._climate_cube is not None and (row, col) in self._climate_cube
+        if self._cache_data and not in_climate_cube:
+            return self._timeseries_cache.get_or_put((row, col), lambda: self._create_timeseries(row, col, location))
+        return self._create_timeseries(row, col, location)
+
+    def _create_timeseries(self, row: int, col: int, location=None):
+        if not location:
+            location = self.location_at(row, col)
+        if self._climate_cube is not None and (row, col) in self._climate_cube:
+            timeseries = TimeSeries.from_dataframe(
+                self._climate_cube.dataframe_at(row, col),
+                metadata=self._meta,
+                location=location,
+                name=f"row: {row}/col: {col}",
+                restorer=self._restorer,
+            )
+        else:
             path_to_csv = self._path_to_rows + "/" + self._row_col_pattern.format(row=row, col=col)
-            if not location:
-                location = self.location_at(row, col)
             timeseries = TimeSeries.from_csv_file(
                 path_to_csv,
                 metadata=self._meta,
@@ -313,27 +837,15 @@ class Dataset(climate_capnp.Dataset.Server, common.Identifiable, common.Persista
                 transform_map=self._transform_map,
                 name=f"row: {row}/col: {col}",
                 restorer=self._restorer,
+                binary_cache_dir=self._binary_cache_dir,
             )
-            if location:
-                location.timeSeries = timeseries
-            if self._cache_data:
-                self._timeseries[(row, col)] = timeseries
-                self._creation_order.append((row, col))
-
-        # print(self._process.memory_percent(memtype="rss"))
-        while (
-            self._cache_data
-            and len(self._creation_order) > 1
-            and self._process.memory_percent(memtype="rss") > self._percentage_of_main_memory_use
-        ):
-            rc = self._creation_order[0] if len(self._creation_order) > 0 else None
-            if rc != (row, col):
-                rc = self._creation_order.popleft()
-                ts: TimeSeries = self._timeseries.pop(rc)
-                ts._df = None
-                # print("after pop:", self._process.memory_percent(memtype="rss"))
-
-        return self._timeseries[(row, col)] if self._cache_data else timeseries
+        if location:
+            location.timeSeries = timeseries
+        return timeseries
+
+    def cache_stats(self):
+        """hits, misses, evictions, bytes and entries of the time series cache"""
+        return self._timeseries_cache.stats()
 
     async def closestTimeSeriesAt(self, latlon, **kwargs):  # (latlon :Geo.LatLonCoord) -> (timeSeries :TimeSeries);
         # closest TimeSeries object which represents the whole time series
@@ -428,3 +940,46 @@ class GetLocationsCallback(climate_capnp.Dataset.GetLocationsCallback.Server):
             except StopIteration:
                 break
         return locations
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Pack the per cell csv files of a climate dataset into a climate cube."
+    )
+    parser.add_argument("path_to_rows", help="directory containing the per cell csv files")
+    parser.add_argument(
+        "path_to_cube", help="path of the climate cube (.npy, a .json index file is written next to it)"
+    )
+    parser.add_argument("--row_col_pattern", default="row-{row}/col-{col}.csv")
+    parser.add_argument("--header_map", type=json.loads, default=None, help="json object mapping csv to element names")
+    parser.add_argument(
+        "--pandas_csv_config", type=json.loads, default=None, help="json object of pandas.read_csv args"
+    )
+    parser.add_argument(
+        "--supported_headers", type=json.loads, default=None, help="json list of the element names to keep"
+    )
+    parser.add_argument(
+        "--transform_map", default=None, help="'module:name' of a dict {element name: function} to import"
+    )
+    args = parser.parse_args()
+
+    transform_map = None
+    if args.transform_map:
+        import importlib
+
+        module_name, attr_name = args.transform_map.split(":")
+        transform_map = getattr(importlib.import_module(module_name), attr_name)
+
+    logging.basicConfig(level=logging.INFO)
+    no_of_cells = create_climate_cube(
+        args.path_to_rows,
+        args.path_to_cube,
+        row_col_pattern=args.row_col_pattern,
+        header_map=args.header_map,
+        supported_headers=args.supported_headers,
+        pandas_csv_config=args.pandas_csv_config,
+        transform_map=transform_map,
+    )
+    logger.info("Created climate cube %s with %s cells", args.path_to_cube, no_of_cells)
@@ -0,0 +1,85 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg-mohnicke@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import threading
+
+from pyproj import CRS, Transformer
+
+# EPSG code of WGS84 lat/lon
+WGS84 = 4326
+
+# EPSG codes of the CRS names used by the MAS services (the same as the geo_capnp.EPSG enumerants)
+_NAME_TO_EPSG = {
+    "latlon": WGS84,
+    "wgs84": WGS84,
+    "gk3": 31467,
+    "gk4": 31468,
+    "gk5": 31469,
+    "utm21s": 32721,
+    "utm32n": 25832,
+}
+
+# CRS and Transformer objects are built lazily and cached per thread, as pyproj Transformers aren't thread-safe
+_local = threading.local()
+
+
+def _thread_caches():
+    if not hasattr(_local, "crss"):
+        _local.crss = {}
+        _local.transformers = {}
+    return _local.crss, _local.transformers
+
+
+def _crs_key(crs):
+    """cheap hashable key for a CRS given as EPSG code, string or CRS object"""
+    if isinstance(crs, CRS):
+        return crs.srs
+    if isinstance(crs, int):
+        return f"EPSG:{crs}"
+    return crs
+
+
+def get_crs(crs):
+    """return the (cached) CRS for the given EPSG code, user input string or CRS object"""
+    if isinstance(crs, CRS):
+        return crs
+    crss, _ = _thread_caches()
+    key = _crs_key(crs)
+    c = crss.get(key)
+    if c is None:
+        c = crss[key] = CRS.from_epsg(crs) if isinstance(crs, int) else CRS.from_user_input(crs)
+    return c
+
+
+def crs_for_name(name, default=None):
+    """return the (cached) CRS for a name like latlon, wgs84, gk5 or utm32n (case insensitive),
+    default if the name is unknown"""
+    epsg = _NAME_TO_EPSG.get(name.lower())
+    return get_crs(epsg) if epsg else default
+
+
+def get_transformer(from_crs, to_crs, always_xy=True):
+    """return the Transformer from from_crs to to_crs (EPSG codes, user input strings or CRS objects)
+    cached for the calling thread"""
+    _, transformers = _thread_caches()
+    key = (_crs_key(from_crs), _crs_key(to_crs), always_xy)
+    trans = transformers.get(key)
+    if trans is None:
+        trans = transformers[key] = Transformer.from_crs(get_crs(from_crs), get_crs(to_crs), always_xy=always_xy)
+    return trans
+
+
+def clear():
+    """drop the CRS and Transformer objects cached for the calling thread"""
+    crss, transformers = _thread_caches()
+    crss.clear()
+    transformers.clear()
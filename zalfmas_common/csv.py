@@ -15,19 +15,71 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF))
 
 import csv
+import hashlib
+import json
+import locale
+import logging
+from pathlib import Path
 
+import numpy as np
+import pandas as pd
 
-def read_csv(path_to_csv, key="id", key_type=(int,), header_row_line=1, data_row_start=2):
-    """read sim setup from csv file"""
+from zalfmas_common.file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def _sniff_dialect(f, sniff_bytes=65536):
+    """determine the dialect from the first sniff_bytes characters (whole lines only) and rewind the file"""
+    sample = f.read(sniff_bytes)
+    if len(sample) == sniff_bytes and "\n" in sample:
+        sample = sample[: sample.rindex("\n") + 1]
+    f.seek(0)
+    return csv.Sniffer().sniff(sample, delimiters=";,\t")
+
+
+_DIALECT_ATTRS = ("delimiter", "quotechar", "escapechar", "doublequote", "skipinitialspace", "quoting")
+
+
+def _dialect_dict(dialect):
+    """the parsing relevant attributes of a (sniffed) dialect as json serializable dict of csv.reader format parameters"""
+    return {attr: getattr(dialect, attr) for attr in _DIALECT_ATTRS}
+
+
+def _bool_or_str(value):
+    if len(value) in (4, 5):
+        lvalue = value.lower()
+        if lvalue == "true":
+            return True
+        if lvalue == "false":
+            return False
+    return value
+
+
+def _conversion_plan(header_cols, keys, key_types, dtypes=None):
+    """create one converter per column once: key columns are cast to their key type,
+    columns with a user dtype to that and all others get the bool detection"""
+    converters = []
+    for header_col in header_cols:
+        if dtypes and header_col in dtypes:
+            converters.append(dtypes[header_col])
+        elif header_col in keys.values():
+            i = next(i for i, k in keys.items() if k == header_col)
+            converters.append(key_types.get(i, key_types[0]))
+        else:
+            converters.append(_bool_or_str)
+    return converters
+
+
+def _iter_converted_rows(path_to_csv, key, key_type, header_row_line, data_row_start, sniff_bytes, dtypes):
+    """yields the header columns first, then (key, list of converted values) per row"""
     composite_key = type(key) is tuple
     keys = {i: v for i, v in enumerate(key)} if composite_key else {0: key}
     key_types = {i: v for i, v in enumerate(key_type)}
 
     with open(path_to_csv) as _:
-        key_to_data = {}
         # determine seperator char
-        dialect = csv.Sniffer().sniff(_.read(), delimiters=";,\t")
-        _.seek(0)
+        dialect = _sniff_dialect(_, sniff_bytes)
         # read csv with seperator char
         reader = csv.reader(_, dialect)
         line = 1
@@ -40,23 +92,280 @@ def read_csv(path_to_csv, key="id", key_type=(int,), header_row_line=1, data_row
             next(reader)
             line += 1
 
+        yield header_cols
+        converters = _conversion_plan(header_cols, keys, key_types, dtypes)
+        key_idxs = [header_cols.index(k) for k in keys.values()]
         for row in reader:
-            data = {}
-            for i, header_col in enumerate(header_cols):
-                value = row[i]
-                if value.lower() in ["true", "false"]:
-                    value = value.lower() == "true"
-                if composite_key and header_col in keys.values():
-                    for i, k in keys.items():
-                        if header_col == k:
-                            value = key_types.get(i, key_types[0])(value)
-                            break
-                elif header_col == key:
-                    value = key_types[0](value)
-                data[header_col] = value
+            if len(row) != len(header_cols):
+                raise ValueError(
+                    f"Row {reader.line_num} of {path_to_csv} has {len(row)} values, but there are "
+                    f"{len(header_cols)} columns."
+                )
+            values = [conv(value) for conv, value in zip(converters, row)]
             if composite_key:
-                key_vals = tuple([key_types.get(i, key_types[0])(data[k]) for i, k in keys.items()])
+                key_vals = tuple([values[i] for i in key_idxs])
             else:
-                key_vals = key_types[0](data[key])
-            key_to_data[key_vals] = data
+                key_vals = values[key_idxs[0]]
+            yield key_vals, values
+
+
+def iter_csv(
+    path_to_csv, key="id", key_type=(int,), header_row_line=1, data_row_start=2, sniff_bytes=65536, dtypes=None
+):
+    """read sim setup from csv file lazily, yields (key, row data) pairs while parsing
+    dtypes - optional {column: callable} to convert the values of these columns"""
+    rows = _iter_converted_rows(path_to_csv, key, key_type, header_row_line, data_row_start, sniff_bytes, dtypes)
+    header_cols = next(rows)
+    for key_vals, values in rows:
+        yield key_vals, dict(zip(header_cols, values))
+
+
+def read_csv(
+    path_to_csv, key="id", key_type=(int,), header_row_line=1, data_row_start=2, sniff_bytes=65536, dtypes=None
+):
+    """read sim setup from csv file"""
+    return dict(iter_csv(path_to_csv, key, key_type, header_row_line, data_row_start, sniff_bytes, dtypes))
+
+
+def _column_array(values):
+    """numpy array of the column values, string columns holding only numbers become numeric arrays"""
+    array = np.array(values)
+    if array.dtype.kind == "U":
+        try:
+            array = pd.to_numeric(array)
+        except (ValueError, TypeError):
+            pass
+    return array
+
+
+def read_csv_columns(
+    path_to_csv,
+    key="id",
+    key_type=(int,),
+    header_row_line=1,
+    data_row_start=2,
+    sniff_bytes=65536,
+    dtypes=None,
+    as_dataframe=False,
+):
+    """read sim setup from csv file column wise for vectorized work,
+    returns {column: numpy array, ...} or a pandas DataFrame (as_dataframe=True) with all rows in file order
+    (unlike read_csv, rows with duplicate keys are all kept),
+    columns without dtype which only contain numbers are returned as int or float arrays"""
+    rows = _iter_converted_rows(path_to_csv, key, key_type, header_row_line, data_row_start, sniff_bytes, dtypes)
+    header_cols = next(rows)
+    columns = [[] for _ in header_cols]
+    for _key_vals, values in rows:
+        for column, value in zip(columns, values):
+            column.append(value)
+    arrays = {
+        header_col: np.array(column) if dtypes and header_col in dtypes else _column_array(column)
+        for header_col, column in zip(header_cols, columns)
+    }
+    if as_dataframe:
+        return pd.DataFrame(arrays)
+    return arrays
+
+
+class CsvKeyIndex:
+    """On-disk index of the byte offset of every row of a sim setup csv file by its (composite) key.
+    The index is stored next to the csv file (or in index_dir) as .npy files of the sorted keys and their offsets
+    plus a .json file with the header and dialect, it is rebuilt if the csv file's size or mtime change.
+    Rows must not contain line breaks inside quoted values.
+    Lookups binary search the keys, seek straight to the requested rows and only parse these."""
+
+    def __init__(
+        self,
+        path_to_csv,
+        key="id",
+        key_type=(int,),
+        header_row_line=1,
+        data_row_start=2,
+        sniff_bytes=65536,
+        dtypes=None,
+        index_dir=None,
+    ):
+        self._path_to_csv = Path(path_to_csv)
+        self._key = key
+        self._key_type = key_type
+        self._header_row_line = header_row_line
+        self._data_row_start = data_row_start
+        self._sniff_bytes = sniff_bytes
+        self._dtypes = dtypes
+        self._encoding = locale.getpreferredencoding(False)
+
+        composite_key = type(key) is tuple
+        self._keys = {i: v for i, v in enumerate(key)} if composite_key else {0: key}
+        self._key_types = {i: v for i, v in enumerate(key_type)}
+        self._composite_key = composite_key
+
+        key_config = json.dumps([key, [kt.__name__ for kt in key_type], header_row_line, data_row_start])
+        key_hash = hashlib.sha1(key_config.encode()).hexdigest()[:16]
+        index_name = f"{self._path_to_csv.name}.{key_hash}.keyidx"
+        base = Path(index_dir) / index_name if index_dir else self._path_to_csv.with_name(index_name)
+        self.path_to_index = base.with_name(base.name + ".json")
+        self._path_to_keys = base.with_name(base.name + ".keys.npy")
+        self._path_to_offsets = base.with_name(base.name + ".offsets.npy")
+        self._index_key = {"key_config": key_config, "dialect_attrs": list(_DIALECT_ATTRS)}
+
+        index = self._load()
+        if index is None:
+            index = self.build()
+        self._header_cols = index["header_cols"]
+        self._dialect = index["dialect"]
+        self._sorted_keys = index["keys"]
+        self._offsets = index["offsets"]
+        self._converters = _conversion_plan(self._header_cols, self._keys, self._key_types, dtypes)
+
+    def _source_key(self):
+        st = self._path_to_csv.stat()
+        return {**self._index_key, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _load(self):
+        try:
+            with self.path_to_index.open() as _:
+                index = json.load(_)
+            if index["source"] != self._source_key():
+                return None
+            index["keys"] = np.load(self._path_to_keys, mmap_mode="r", allow_pickle=False)
+            index["offsets"] = np.load(self._path_to_offsets, mmap_mode="r", allow_pickle=False)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if index["keys"].dtype.names is None or len(index["keys"]) != len(index["offsets"]):
+            return None
+        return index
+
+    def _parse_line(self, line):
+        return next(csv.reader([line.decode(self._encoding)], **self._dialect))
+
+    def build(self):
+        """scan the csv file once, record the byte offset of every key and store the index"""
+        source_key = self._source_key()
+        with self._path_to_csv.open() as _:
+            dialect = _sniff_dialect(_, self._sniff_bytes)
+        self._dialect = _dialect_dict(dialect)
+
+        header_cols = None
+        key_columns = [[] for _ in self._keys]
+        offsets = []
+        key_converters = None
+        with self._path_to_csv.open("rb") as _:
+            offset = 0
+            for line_no, line in enumerate(_, start=1):
+                if line_no == self._header_row_line:
+                    header_cols = self._parse_line(line)
+                    converters = _conversion_plan(header_cols, self._keys, self._key_types)
+                    key_converters = [
+                        (header_cols.index(k), converters[header_cols.index(k)]) for k in self._keys.values()
+                    ]
+                elif line_no >= self._data_row_start and line.strip():
+                    row = self._parse_line(line)
+                    for column, (i, conv) in zip(key_columns, key_converters):
+                        column.append(conv(row[i]))
+                    offsets.append(offset)
+                offset += len(line)
+
+        # one structured array of the keys sorted (field by field) for binary search,
+        # for duplicate keys the last row wins
+        columns = [np.array(column) for column in key_columns]
+        keys = np.empty(len(offsets), dtype=[(f"k{i}", column.dtype) for i, column in enumerate(columns)])
+        for i, column in enumerate(columns):
+            keys[f"k{i}"] = column
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        offsets = np.array(offsets, dtype=np.int64)[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        keys = keys[last]
+        offsets = offsets[last]
+
+        index = {"source": source_key, "header_cols": header_cols, "dialect": self._dialect}
+        try:
+            atomic_write(self._path_to_keys, lambda f: np.save(f, keys, allow_pickle=False))
+            atomic_write(self._path_to_offsets, lambda f: np.save(f, offsets, allow_pickle=False))
+            atomic_write(self.path_to_index, lambda f: json.dump(index, f), mode="w")
+        except (OSError, ValueError) as e:
+            # ValueError if the key type can't be stored without pickling
+            logger.warning("Couldn't write csv key index %s: %s", self.path_to_index, e)
+        return {**index, "keys": keys, "offsets": offsets}
+
+    def _find(self, keys):
+        """return the positions of the found keys in keys and their offsets"""
+        keys = [k if self._composite_key else (k,) for k in keys]
+        dtype = self._sorted_keys.dtype
+        try:
+            query = np.array(keys, dtype=dtype)
+            positions = np.arange(len(keys))
+        except (ValueError, TypeError, OverflowError):
+            # leave out the keys not convertible to the key types
+            query, positions = [], []
+            for i, k in enumerate(keys):
+                try:
+                    query.append(np.array(k, dtype=dtype))
+                    positions.append(i)
+                except (ValueError, TypeError, OverflowError):
+                    continue
+            query = np.array(query, dtype=dtype)
+            positions = np.array(positions, dtype=np.intp)
+        if len(self._sorted_keys) == 0 or len(query) == 0:
+            return [], []
+        idxs = np.minimum(np.searchsorted(self._sorted_keys, query), len(self._sorted_keys) - 1)
+        # compare the original keys, as the conversion to the key dtype may truncate strings or parse numbers
+        found = [
+            (pos, idx)
+            for pos, idx in zip(positions.tolist(), idxs.tolist())
+            if self._sorted_keys[idx].item() == keys[pos]
+        ]
+        return [pos for pos, _ in found], [int(self._offsets[idx]) for _, idx in found]
+
+    def __contains__(self, key):
+        return len(self._find([key])[0]) > 0
+
+    def __len__(self):
+        return len(self._sorted_keys)
+
+    def keys(self):
+        """all keys (tuples for composite keys) in sorted order"""
+        keys = self._sorted_keys.tolist()
+        return keys if self._composite_key else [k[0] for k in keys]
+
+    def lookup(self, keys):
+        """return {key: row data} for the given keys (missing keys are left out),
+        rows are read in file order, each with one seek"""
+        keys = list(keys)
+        positions, offsets = self._find(keys)
+        key_to_data = {}
+        with self._path_to_csv.open("rb") as _:
+            for offset, pos in sorted(zip(offsets, positions)):
+                _.seek(offset)
+                row = self._parse_line(_.readline())
+                key_to_data[keys[pos]] = {
+                    header_col: conv(value) for header_col, conv, value in zip(self._header_cols, self._converters, row)
+                }
         return key_to_data
+
+
+def read_csv_rows(
+    path_to_csv,
+    keys,
+    key="id",
+    key_type=(int,),
+    header_row_line=1,
+    data_row_start=2,
+    sniff_bytes=65536,
+    dtypes=None,
+    index_dir=None,
+):
+    """read only the rows with the given keys from the sim setup csv file using (and creating if necessary)
+    the on-disk CsvKeyIndex, returns {key: row data}"""
+    index = CsvKeyIndex(
+        path_to_csv,
+        key=key,
+        key_type=key_type,
+        header_row_line=header_row_line,
+        data_row_start=data_row_start,
+        sniff_bytes=sniff_bytes,
+        dtypes=dtypes,
+        index_dir=index_dir,
+    )
+    return index.lookup(keys)
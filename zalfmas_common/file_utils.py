@@ -0,0 +1,117 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg-mohnicke@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import types
+from pathlib import Path
+
+import numpy as np
+
+
+def atomic_write(path, write_fn, mode="wb"):
+    """call write_fn(f) with a new temporary file f next to path, which then replaces path atomically,
+    so readers never see partially written files and concurrent writers (threads or processes) don't interfere
+    write_fn may also reopen the file by its name f.name (e.g. to memory map it)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            write_fn(tmp)
+        Path(tmp.name).replace(path)
+    except BaseException:
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
+
+
+def private_cache_dir(name):
+    """return the directory name in the current user's cache directory ($XDG_CACHE_HOME or ~/.cache)/zalfmas_common,
+    it is created accessible for the current user only"""
+    base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "zalfmas_common"
+    base.parent.mkdir(parents=True, exist_ok=True)
+    base.mkdir(mode=0o700, exist_ok=True)
+    path = base / name
+    path.mkdir(mode=0o700, exist_ok=True)
+    return path
+
+
+def is_private_file(path):
+    """true if the file at path is owned by the current user and not writable by anyone else
+    (always true on platforms without file ownership)"""
+    st = Path(path).stat()
+    if not hasattr(os, "getuid"):
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def save_npy_and_json(path_to_npy_file, path_to_json_file, array, info):
+    """store array as .npy file and info as .json file, both are replaced atomically (first the .npy file)"""
+    atomic_write(path_to_npy_file, lambda f: np.save(f, array, allow_pickle=False))
+    atomic_write(path_to_json_file, lambda f: json.dump(info, f), mode="w")
+
+
+def _code_hash(code):
+    # nested code objects (inner functions, comprehensions) are hashed recursively, as their repr contains an address
+    parts = [code.co_code]
+    for const in code.co_consts:
+        parts.append(_code_hash(const).encode() if isinstance(const, types.CodeType) else repr(const).encode())
+    return hashlib.sha1(b"\0".join(parts)).hexdigest()
+
+
+def _closure_values(func):
+    values = []
+    for cell in func.__closure__ or ():
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            values.append(None)
+    return values
+
+
+# default reprs of objects contain their memory address, e.g. <function <lambda> at 0x7f...>
+_ADDRESS_REPR = re.compile(r" at 0x[0-9a-fA-F]+>")
+
+
+def callable_key(func, require_stable=False):
+    """identify a (transform) function by name, code, closure values, defaults and the simple (bool, number, string)
+    globals it references, for bound methods also by the object they are bound to, so changed functions invalidate
+    cached data
+    values whose repr isn't stable across processes just lead to cache misses, unless require_stable is set,
+    then a ValueError is raised, as a different object reusing the same address could hit stale data"""
+    code = getattr(func, "__code__", None)
+    if code is None:
+        state = repr(func)
+        name = ""
+    else:
+        func_globals = getattr(func, "__globals__", {})
+        simple_globals = sorted(
+            (global_name, func_globals[global_name])
+            for global_name in code.co_names
+            if isinstance(func_globals.get(global_name), (bool, int, float, str))
+        )
+        state = repr(
+            [
+                getattr(func, "__self__", None),
+                _closure_values(func),
+                func.__defaults__,
+                func.__kwdefaults__,
+                simple_globals,
+            ]
+        )
+        name = f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', '')}:{_code_hash(code)}:"
+    if require_stable and _ADDRESS_REPR.search(state):
+        raise ValueError(f"Can't derive a key for {func!r} which is stable across processes.")
+    return name + hashlib.sha1(state.encode()).hexdigest()
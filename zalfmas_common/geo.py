@@ -10,10 +10,13 @@
 #
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 
+import numpy as np
 from mas.schema.geo import geo_capnp
-from pyproj import CRS, Transformer
+
+from zalfmas_common import crs_registry as crsr
 
 
 def name_to_struct_instance(name, x=None, y=None, default=None):
@@ -89,79 +92,183 @@ def set_xy(obj, x, y):
 
 
 def name_to_crs(name, default=None):
-    return {
-        "latlon": CRS.from_epsg(geo_capnp.EPSG.wgs84),
-        "wgs84": CRS.from_epsg(geo_capnp.EPSG.wgs84),
-        "gk3": CRS.from_epsg(geo_capnp.EPSG.gk3),
-        "gk4": CRS.from_epsg(geo_capnp.EPSG.gk4),
-        "gk5": CRS.from_epsg(geo_capnp.EPSG.gk5),
-        "utm21s": CRS.from_epsg(geo_capnp.EPSG.utm21S),
-        "utm32n": CRS.from_epsg(geo_capnp.EPSG.utm32N),
-    }.get(name.lower(), default)
+    return crsr.crs_for_name(name, default)
 
 
-def geo_coord_to_latlon(geo_coord):
-    if not hasattr(geo_coord_to_latlon, "gk_cache"):
-        geo_coord_to_latlon.gk_cache = {}
-    if not hasattr(geo_coord_to_latlon, "utm_cache"):
-        geo_coord_to_latlon.utm_cache = {}
-    if not hasattr(geo_coord_to_latlon, "latlon_crs"):
-        geo_coord_to_latlon.latlon_crs = name_to_crs("latlon")
+def _geo_coord_crs_name_and_xy(geo_coord):
+    """return the crs name and (x, y) of a geo coord union"""
+    which = geo_coord.which()
+    if which == "gk":
+        return "gk" + str(geo_coord.gk.meridianNo), (geo_coord.gk.r, geo_coord.gk.h)
+    elif which == "latlon":
+        return "latlon", (geo_coord.latlon.lon, geo_coord.latlon.lat)
+    elif which == "utm":
+        return "utm" + str(geo_coord.utm.zone) + geo_coord.utm.latitudeBand, (geo_coord.utm.r, geo_coord.utm.h)
+    return None, None
+
+
+def _epsg_from_crs_name(crs_name):
+    # gk and utm names map directly to the EPSG enumerants (e.g. gk5, utm32N)
+    return name_to_crs("latlon") if crs_name == "latlon" else int(geo_capnp.EPSG[crs_name])
+
+
+class TransformMemo:
+    """LRU memo of single point coordinate transforms.
+    Keys are the source and target crs plus the coordinates rounded to precision decimals,
+    so points closer than that share one result. At most max_size results are kept."""
+
+    def __init__(self, max_size=100000, precision=6):
+        self.max_size = max_size
+        self.precision = precision
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def transform(self, from_name, to_name, trans, x, y):
+        """return trans.transform(x, y), memoized"""
+        key = (from_name, to_name, round(x, self.precision), round(y, self.precision))
+        with self._lock:
+            res = self._results.get(key)
+            if res is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return res
+            self.misses += 1
+        res = trans.transform(x, y)
+        with self._lock:
+            self._results[key] = res
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        return res
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._results),
+                "max_size": self.max_size,
+            }
+
+
+# memo used by geo_coord_to_latlon and transform_from_to_geo_coord, None = disabled
+_transform_memo = None
+
+
+def enable_transform_memo(max_size=100000, precision=6):
+    """memoize the transforms of geo_coord_to_latlon and transform_from_to_geo_coord, returns the memo"""
+    global _transform_memo
+    _transform_memo = TransformMemo(max_size=max_size, precision=precision)
+    return _transform_memo
 
+
+def disable_transform_memo():
+    global _transform_memo
+    _transform_memo = None
+
+
+def transform_memo():
+    """the currently used TransformMemo or None"""
+    return _transform_memo
+
+
+def _transform_point(from_name, to_name, trans, x, y):
+    memo = _transform_memo
+    if memo is None:
+        return trans.transform(x, y)
+    return memo.transform(from_name, to_name, trans, x, y)
+
+
+def geo_coord_to_latlon(geo_coord):
     which = geo_coord.which()
     if which == "gk":
-        meridian = geo_coord.gk.meridianNo
-        if meridian not in geo_coord_to_latlon.gk_cache:
-            gk_crs = CRS.from_epsg(geo_capnp.EPSG["gk" + str(meridian)])
-            trans = geo_coord_to_latlon.gk_cache[meridian] = Transformer.from_crs(
-                gk_crs, geo_coord_to_latlon.latlon_crs, always_xy=True
-            )
-        else:
-            trans = geo_coord_to_latlon.gk_cache[meridian]
-        lon, lat = trans.transform(geo_coord.gk.r, geo_coord.gk.h)
+        gk_name = "gk" + str(geo_coord.gk.meridianNo)
+        trans = crsr.get_transformer(int(geo_capnp.EPSG[gk_name]), name_to_crs("latlon"))
+        lon, lat = _transform_point(gk_name, "latlon", trans, geo_coord.gk.r, geo_coord.gk.h)
     elif which == "latlon":
         lat, lon = geo_coord.latlon.lat, geo_coord.latlon.lon
     elif which == "utm":
-        utm_id = str(geo_coord.utm.zone) + geo_coord.utm.latitudeBand
-        if utm_id not in geo_coord_to_latlon.utm_cache:
-            utm_crs = CRS.from_epsg(geo_capnp.EPSG["utm" + utm_id])
-            trans = geo_coord_to_latlon.utm_cache[utm_id] = Transformer.from_crs(
-                utm_crs, geo_coord_to_latlon.latlon_crs, always_xy=True
-            )
-        else:
-            trans = geo_coord_to_latlon.utm_cache[utm_id]
-        lon, lat = trans.transform(geo_coord.utm.r, geo_coord.utm.h)
+        utm_name = "utm" + str(geo_coord.utm.zone) + geo_coord.utm.latitudeBand
+        trans = crsr.get_transformer(int(geo_capnp.EPSG[utm_name]), name_to_crs("latlon"))
+        lon, lat = _transform_point(utm_name, "latlon", trans, geo_coord.utm.r, geo_coord.utm.h)
 
     return lat, lon
 
 
+def _transform_grouped(crs_names, xs, ys, to_crs, crs_name_to_crs):
+    """transform the points (xs, ys) given in the crs named crs_names[i] to to_crs,
+    all points of one source crs are transformed with one pyproj call"""
+    to_xs = np.full(len(xs), np.nan)
+    to_ys = np.full(len(ys), np.nan)
+    groups = defaultdict(list)
+    for i, crs_name in enumerate(crs_names):
+        if crs_name is not None:
+            groups[crs_name].append(i)
+    for crs_name, idxs in groups.items():
+        idxs = np.array(idxs)
+        trans = crsr.get_transformer(crs_name_to_crs(crs_name), to_crs)
+        to_xs[idxs], to_ys[idxs] = trans.transform(xs[idxs], ys[idxs])
+    return to_xs, to_ys
+
+
+def geo_coords_to_latlons(geo_coords):
+    """batch version of geo_coord_to_latlon for a list of geo coord unions (e.g. a capnp List(GeoCoord)),
+    the coords are grouped by source crs and each group is transformed with one pyproj call
+    returns (lats, lons) as numpy arrays, nan for unsupported coords"""
+    crs_names = []
+    xs = np.empty(len(geo_coords))
+    ys = np.empty(len(geo_coords))
+    for i, geo_coord in enumerate(geo_coords):
+        crs_name, xy = _geo_coord_crs_name_and_xy(geo_coord)
+        crs_names.append(crs_name)
+        xs[i], ys[i] = xy if xy else (np.nan, np.nan)
+    lons, lats = _transform_grouped(crs_names, xs, ys, name_to_crs("latlon"), _epsg_from_crs_name)
+    return lats, lons
+
+
+def _struct_crs_name(coord):
+    schema = coord.schema
+    if schema == geo_capnp.LatLonCoord.schema:
+        return "latlon"
+    elif schema == geo_capnp.UTMCoord.schema:
+        return "utm" + str(coord.zone) + coord.latitudeBand
+    elif schema == geo_capnp.GKCoord.schema:
+        return "gk" + str(coord.meridianNo)
+    return None
+
+
 def transform_from_to_geo_coord(from_coord, to_name, default=None):
-    if not hasattr(transform_from_to_geo_coord, "cache"):
-        transform_from_to_geo_coord.cache = defaultdict(dict)
-
-    to_coord = default
-    from_coord_schema = from_coord.schema
-    if from_coord_schema == geo_capnp.LatLonCoord.schema:
-        trans = transform_from_to_geo_coord.cache["latlon"].setdefault(
-            to_name,
-            Transformer.from_crs(name_to_crs("latlon"), name_to_crs(to_name), always_xy=True),
-        )
-        res = trans.transform(*get_xy(from_coord))
-        to_coord = name_to_struct_instance(to_name, x=res[0], y=res[1])
-    elif from_coord_schema == geo_capnp.UTMCoord.schema:
-        utm_id = "utm" + str(from_coord.zone) + from_coord.latitudeBand
-        trans = transform_from_to_geo_coord.cache[utm_id].setdefault(
-            to_name,
-            Transformer.from_crs(name_to_crs(utm_id), name_to_crs(to_name), always_xy=True),
-        )
-        res = trans.transform(*get_xy(from_coord))
-        to_coord = name_to_struct_instance(to_name, x=res[0], y=res[1])
-    elif from_coord_schema == geo_capnp.GKCoord.schema:
-        gk_id = "gk" + str(from_coord.meridian)
-        trans = transform_from_to_geo_coord.cache[gk_id].setdefault(
-            to_name,
-            Transformer.from_crs(name_to_crs(gk_id), name_to_crs(to_name), always_xy=True),
-        )
-        res = trans.transform(*get_xy(from_coord))
-        to_coord = name_to_struct_instance(to_name, x=res[0], y=res[1])
-    return to_coord
+    from_name = _struct_crs_name(from_coord)
+    if from_name is None:
+        return default
+
+    trans = crsr.get_transformer(name_to_crs(from_name), name_to_crs(to_name))
+    res = _transform_point(from_name, to_name.lower(), trans, *get_xy(from_coord))
+    return name_to_struct_instance(to_name, x=res[0], y=res[1])
+
+
+def transform_from_to_geo_coords(from_coords, to_name, to_coords=None):
+    """batch version of transform_from_to_geo_coord for a list of LatLonCoord, UTMCoord or GKCoord structs,
+    the coords are grouped by source crs and each group is transformed with one pyproj call
+    to_coords - optional pre-initialized capnp list of to_name structs (same length) the results are written into
+    returns (xs, ys) as numpy arrays in the to_name crs, nan for unsupported coords"""
+    crs_names = []
+    xs = np.empty(len(from_coords))
+    ys = np.empty(len(from_coords))
+    for i, from_coord in enumerate(from_coords):
+        crs_name = _struct_crs_name(from_coord)
+        crs_names.append(crs_name)
+        xs[i], ys[i] = get_xy(from_coord) if crs_name else (np.nan, np.nan)
+    to_xs, to_ys = _transform_grouped(crs_names, xs, ys, name_to_crs(to_name), name_to_crs)
+    if to_coords is not None:
+        for to_coord, x, y in zip(to_coords, to_xs.tolist(), to_ys.tolist()):
+            set_xy(to_coord, x, y)
+    return to_xs, to_ys
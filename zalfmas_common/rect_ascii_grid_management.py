@@ -11,43 +11,307 @@
 #
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
+import asyncio
 import gzip
+import hashlib
+import io
+import itertools
 import json
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import numpy as np
-from pyproj import CRS, Transformer
+import scipy
 from scipy.interpolate import NearestNDInterpolator
+from scipy.ndimage import distance_transform_edt
+
+from zalfmas_common import crs_registry as crsr
+from zalfmas_common.file_utils import (
+    atomic_write,
+    callable_key,
+    is_private_file,
+    private_cache_dir,
+    save_npy_and_json,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _open_ascii_grid(path_to_ascii_grid_file):
+    """open (possibly gzipped) esri ascii grid file as text stream"""
+    if str(path_to_ascii_grid_file)[-3:] == ".gz":
+        return gzip.open(path_to_ascii_grid_file, mode="rt")
+    return open(path_to_ascii_grid_file)
+
+
+def _read_header_from(f, no_of_header_lines=6):
+    possible_headers = [
+        "ncols",
+        "nrows",
+        "xllcorner",
+        "yllcorner",
+        "cellsize",
+        "nodata_value",
+    ]
+    metadata = {}
+    header_str = ""
+    for i in range(0, no_of_header_lines):
+        line = f.readline()
+        s_line = [x for x in line.split() if len(x) > 0]
+        key = s_line[0].strip().lower()
+        if len(s_line) > 1 and key in possible_headers:
+            metadata[key] = float(s_line[1].strip())
+            header_str += line
+    return metadata, header_str
 
 
 def read_header(path_to_ascii_grid_file, no_of_header_lines=6):
     """read metadata from esri ascii grid file"""
+    with _open_ascii_grid(path_to_ascii_grid_file) as _:
+        return _read_header_from(_, no_of_header_lines)
+
+
+def _read_header_and_first_body_line_from(f):
+    """read header lines as long as they start with a keyword, returns (metadata, header_str, first_body_line)"""
+    header_lines = []
+    line = f.readline()
+    while line and line.lstrip()[:1].isalpha():
+        header_lines.append(line)
+        line = f.readline()
+    metadata, header_str = _read_header_from(io.StringIO("".join(header_lines)), len(header_lines))
+    return metadata, header_str, line
+
+
+def _read_header_and_body_lines_from(f, no_of_header_lines=None):
+    """read the header and return (metadata, iterator over the body lines)"""
+    if no_of_header_lines is None:
+        metadata, _header_str, first_body_line = _read_header_and_first_body_line_from(f)
+        return metadata, itertools.chain([first_body_line] if first_body_line else [], f)
+    metadata, _header_str = _read_header_from(f, no_of_header_lines)
+    return metadata, f
+
+
+def _parse_ascii_grid_rows_into(grid, lines_it, ncols, path_to_ascii_grid_file, col_slice=None, block_rows=256):
+    """parse len(grid) rows of ncols values from lines_it in blocks of block_rows rows into grid,
+    if col_slice is given only these columns of each row are stored"""
+    nrows = len(grid)
+    row = 0
+    while row < nrows:
+        lines = list(itertools.islice(lines_it, min(block_rows, nrows - row)))
+        if not lines:
+            break
+        block = np.fromstring("".join(lines), dtype=grid.dtype, sep=" ")
+        if block.size != len(lines) * ncols:
+            raise ValueError(
+                f"Couldn't parse rows {row}-{row + len(lines)} of {path_to_ascii_grid_file} as {ncols} columns."
+            )
+        block = block.reshape(len(lines), ncols)
+        grid[row : row + len(lines)] = block if col_slice is None else block[:, col_slice]
+        row += len(lines)
+    if row < nrows:
+        raise ValueError(f"Expected {nrows} rows in {path_to_ascii_grid_file}, but read only {row}.")
+
+
+def read_ascii_grid(path_to_ascii_grid_file, datatype=int, no_of_header_lines=None, block_rows=256):
+    """read metadata and grid from esri ascii grid file
+    The body is parsed in blocks of block_rows rows straight into a preallocated array of the requested datatype,
+    so apart from the final array only one block of text is held in memory. Gzipped files are streamed.
+    no_of_header_lines - if None, the header lines are detected (all lines starting with a keyword)
+    returns (grid, metadata)"""
+    with _open_ascii_grid(path_to_ascii_grid_file) as _:
+        metadata, lines_it = _read_header_and_body_lines_from(_, no_of_header_lines)
+        grid = np.empty((int(metadata["nrows"]), int(metadata["ncols"])), dtype=datatype)
+        _parse_ascii_grid_rows_into(
+            grid, lines_it, int(metadata["ncols"]), path_to_ascii_grid_file, block_rows=block_rows
+        )
+    return grid, metadata
+
+
+def grid_window(metadata, bbox):
+    """return (row_start, row_end, col_start, col_end) of the cells of the grid described by metadata
+    which intersect the bounding box bbox = (min_x, min_y, max_x, max_y) given in the grid's CRS"""
+    min_x, min_y, max_x, max_y = bbox
+    cellsize = float(metadata["cellsize"])
+    nrows = int(metadata["nrows"])
+    ncols = int(metadata["ncols"])
+    xll = float(metadata["xllcorner"])
+    yul = float(metadata["yllcorner"]) + nrows * cellsize
+    col_start = max(int(np.floor((min_x - xll) / cellsize)), 0)
+    col_end = min(int(np.ceil((max_x - xll) / cellsize)), ncols)
+    row_start = max(int(np.floor((yul - max_y) / cellsize)), 0)
+    row_end = min(int(np.ceil((yul - min_y) / cellsize)), nrows)
+    if row_start >= row_end or col_start >= col_end:
+        raise ValueError(f"Bounding box {bbox} doesn't intersect the grid.")
+    return row_start, row_end, col_start, col_end
+
+
+def window_metadata(metadata, row_start, row_end, col_start, col_end):
+    """return the metadata of the sub grid [row_start:row_end, col_start:col_end]"""
+    cellsize = float(metadata["cellsize"])
+    return {
+        **metadata,
+        "ncols": float(col_end - col_start),
+        "nrows": float(row_end - row_start),
+        "xllcorner": float(metadata["xllcorner"]) + col_start * cellsize,
+        "yllcorner": float(metadata["yllcorner"]) + (int(metadata["nrows"]) - row_end) * cellsize,
+    }
+
+
+def load_grid_window_from_ascii_grid(
+    path_to_ascii_grid,
+    bbox,
+    datatype=int,
+    bbox_crs=None,
+    grid_crs=None,
+    no_of_header_rows=None,
+    use_binary_cache=False,
+    cache_dir=None,
+    block_rows=256,
+):
+    """load only the cells of the esri ascii grid intersecting the bounding box
+    bbox - (min_x, min_y, max_x, max_y) in the grid's CRS or, if bbox_crs is given, in bbox_crs
+           (for lat/lon use (min_lon, min_lat, max_lon, max_lat)), grid_crs is needed then too
+    Rows above the window are skipped without parsing them and reading stops after the window.
+    If use_binary_cache is set and a valid binary cache exists, the window is copied from the memory mapped grid.
+    returns (sub grid, metadata of the sub grid)"""
+    if bbox_crs is not None:
+        if grid_crs is None:
+            raise ValueError("grid_crs is needed if the bounding box is given in bbox_crs")
+        bbox = crsr.get_transformer(bbox_crs, grid_crs).transform_bounds(*bbox)
+
+    if use_binary_cache:
+        cached = _load_from_binary_cache(path_to_ascii_grid, datatype, cache_dir)
+        if cached:
+            grid, metadata = cached
+            row_start, row_end, col_start, col_end = grid_window(metadata, bbox)
+            sub_grid = np.array(grid[row_start:row_end, col_start:col_end])
+            return sub_grid, window_metadata(metadata, row_start, row_end, col_start, col_end)
+
+    with _open_ascii_grid(path_to_ascii_grid) as _:
+        metadata, lines_it = _read_header_and_body_lines_from(_, no_of_header_rows)
+        row_start, row_end, col_start, col_end = grid_window(metadata, bbox)
+        # skip the rows above the window without parsing them
+        for _line in itertools.islice(lines_it, row_start):
+            pass
+        sub_grid = np.empty((row_end - row_start, col_end - col_start), dtype=datatype)
+        _parse_ascii_grid_rows_into(
+            sub_grid,
+            lines_it,
+            int(metadata["ncols"]),
+            path_to_ascii_grid,
+            col_slice=slice(col_start, col_end),
+            block_rows=block_rows,
+        )
+    return sub_grid, window_metadata(metadata, row_start, row_end, col_start, col_end)
+
+
+def _header_value_str(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
 
-    def read_header_from(f):
-        possible_headers = [
-            "ncols",
-            "nrows",
-            "xllcorner",
-            "yllcorner",
-            "cellsize",
-            "nodata_value",
+class AsciiGridWriter:
+    """Write an esri ascii grid incrementally, rows can be written while results are still coming in.
+    The body is formatted in blocks with one string formatting operation per block.
+    Values of an integer dtype are written as integers, all others as floats with precision decimal places,
+    the dtype is taken from the first rows written if it isn't given,
+    the file is gzipped if gzipped is set (by default if the path ends with .gz)."""
+
+    def __init__(
+        self,
+        path_to_ascii_grid_file,
+        metadata,
+        precision=4,
+        gzipped=None,
+        block_rows=256,
+        compresslevel=6,
+        dtype=None,
+    ):
+        self._path = path_to_ascii_grid_file
+        self._ncols = int(metadata["ncols"])
+        self._nrows = int(metadata["nrows"])
+        self._precision = precision
+        self._dtype = None
+        self._row_fmt = None
+        if dtype is not None:
+            self._set_dtype(dtype)
+        self._block_rows = block_rows
+        self._rows_written = 0
+        if gzipped is None:
+            gzipped = str(path_to_ascii_grid_file)[-3:] == ".gz"
+        if gzipped:
+            self._f = gzip.open(path_to_ascii_grid_file, mode="wt", compresslevel=compresslevel)
+        else:
+            self._f = Path(path_to_ascii_grid_file).open("w")
+        header_keys = [
+            ("ncols", "ncols"),
+            ("nrows", "nrows"),
+            ("xllcorner", "xllcorner"),
+            ("yllcorner", "yllcorner"),
+            ("cellsize", "cellsize"),
+            ("nodata_value", "NODATA_value"),
         ]
-        metadata = {}
-        header_str = ""
-        for i in range(0, no_of_header_lines):
-            line = f.readline()
-            s_line = [x for x in line.split() if len(x) > 0]
-            key = s_line[0].strip().lower()
-            if len(s_line) > 1 and key in possible_headers:
-                metadata[key] = float(s_line[1].strip())
-                header_str += line
-        return metadata, header_str
+        for key, header in header_keys:
+            if key in metadata:
+                self._f.write(f"{header} {_header_value_str(metadata[key])}\n")
+
+    def _set_dtype(self, dtype):
+        self._dtype = np.dtype(dtype)
+        value_fmt = "%d" if np.issubdtype(self._dtype, np.integer) else f"%.{self._precision}f"
+        self._row_fmt = " ".join([value_fmt] * self._ncols) + "\n"
+
+    def write_rows(self, rows):
+        """append one row (1D array) or several rows (2D array) to the grid"""
+        rows = np.atleast_2d(np.asarray(rows))
+        if rows.shape[1] != self._ncols:
+            raise ValueError(f"Expected rows of {self._ncols} columns, but got {rows.shape[1]}.")
+        if self._rows_written + len(rows) > self._nrows:
+            raise ValueError(f"Grid {self._path} has only {self._nrows} rows.")
+        if self._dtype is None:
+            self._set_dtype(rows.dtype)
+        if not np.can_cast(rows.dtype, self._dtype, casting="same_kind"):
+            raise ValueError(f"Can't write {rows.dtype} rows to grid {self._path} of dtype {self._dtype}.")
+        for start in range(0, len(rows), self._block_rows):
+            block = rows[start : start + self._block_rows]
+            self._f.write((self._row_fmt * len(block)) % tuple(block.ravel().tolist()))
+        self._rows_written += len(rows)
+
+    def close(self):
+        """close the file, raises a ValueError if not all rows have been written"""
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        if self._rows_written != self._nrows:
+            raise ValueError(f"Grid {self._path} has {self._nrows} rows, but only {self._rows_written} were written.")
 
-    if path_to_ascii_grid_file[-3:] == ".gz":
-        with gzip.open(path_to_ascii_grid_file, mode="rt") as _:
-            return read_header_from(_)
+    def __enter__(self):
+        return self
 
-    with open(path_to_ascii_grid_file) as _:
-        return read_header_from(_)
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def write_ascii_grid(path_to_ascii_grid_file, grid, metadata, precision=4, gzipped=None, block_rows=256):
+    """write the 2D grid with the given metadata as esri ascii grid (see AsciiGridWriter)"""
+    metadata = {**metadata, "nrows": grid.shape[0], "ncols": grid.shape[1]}
+    with AsciiGridWriter(
+        path_to_ascii_grid_file,
+        metadata,
+        precision=precision,
+        gzipped=gzipped,
+        block_rows=block_rows,
+        dtype=grid.dtype,
+    ) as writer:
+        writer.write_rows(grid)
 
 
 def create_interpolator_from_rect_grid(
@@ -57,13 +321,147 @@ def create_interpolator_from_rect_grid(
     transform_func=None,
     row_col_value=False,
     no_points_to_values=False,
+    index_lookup=False,
+    index_cache_path=None,
+    index_cache_key=None,
 ):
     """Create an interpolator from the given grid.
     It is assumed that the values in the grid have a rectangular projection
     so the interpolators underlying distance calculations make sense.
     grid - 2D (numpy) array of values
     metadata - data describing the grid
-    transform_func - a function f(r, h) -> (r, h) to transform the r, h values before storing them"""
+    transform_func - a function f(rs, hs) -> (rs, hs) to transform the r, h values before storing them,
+                     it is called once with numpy arrays of all cell centers (e.g. a pyproj Transformer.transform)
+    index_lookup - return a RectGridInterpolator which computes row/col directly instead of building a KD-tree,
+                   can't be combined with transform_func as the transformed points aren't regular anymore
+    index_cache_path - if given, the built interpolator (and points_to_values) is stored at this path
+                       and loaded from there instead of being rebuilt, as long as index_cache_key matches
+    index_cache_key - identifies the grid and options the index has been built from, by default it is derived from
+                      the metadata, a hash of the grid values and the other arguments (transform_func by its code and
+                      state, a ValueError is raised if that isn't stable across processes, pass a key then)"""
+
+    if index_cache_path:
+        if index_cache_key is None:
+            try:
+                transform_key = callable_key(transform_func, require_stable=True) if transform_func else None
+            except ValueError as e:
+                raise ValueError(f"{e} Pass an explicit index_cache_key.") from e
+            index_cache_key = {
+                "metadata": {str(k): str(v) for k, v in sorted(metadata.items())},
+                "grid": [
+                    list(grid.shape),
+                    str(grid.dtype),
+                    hashlib.sha1(np.ascontiguousarray(grid).data).hexdigest(),
+                ],
+                "options": [ignore_nodata, transform_key, row_col_value, no_points_to_values, index_lookup],
+            }
+        index_cache_key = {"key": index_cache_key, **_index_library_versions()}
+        cached = load_interpolator_index(index_cache_path, index_cache_key)
+        if cached is not None:
+            return cached
+        interpolator_and_points_to_values = create_interpolator_from_rect_grid(
+            grid,
+            metadata,
+            ignore_nodata=ignore_nodata,
+            transform_func=transform_func,
+            row_col_value=row_col_value,
+            no_points_to_values=no_points_to_values,
+            index_lookup=index_lookup,
+        )
+        save_interpolator_index(interpolator_and_points_to_values, index_cache_path, index_cache_key)
+        return interpolator_and_points_to_values
+
+    if index_lookup:
+        if transform_func:
+            raise ValueError("index_lookup can't be used together with a transform_func")
+        points_to_values = None
+        if not no_points_to_values:
+            _, _, rs, hs, grid_values = _rect_grid_points_and_values(grid, metadata, ignore_nodata=ignore_nodata)
+            points_to_values = PointsToValues(rs, hs, grid_values)
+        return RectGridInterpolator(
+            grid, metadata, ignore_nodata=ignore_nodata, row_col_value=row_col_value
+        ), points_to_values
+
+    points, values, rs, hs, grid_values = _rect_grid_points_and_values(
+        grid, metadata, ignore_nodata=ignore_nodata, transform_func=transform_func, row_col_value=row_col_value
+    )
+
+    points_to_values = None if no_points_to_values else PointsToValues(rs, hs, grid_values)
+
+    return NearestNDInterpolator(points, values), points_to_values
+
+
+class PointsToValues:
+    """Compact, read-only mapping of exact (r, h) coordinates to values.
+    Behaves like the dict {(r, h): value, ...} but stores the coordinates as one sorted array
+    of 16 byte keys plus the values array and looks them up by binary search."""
+
+    _key_dtype = np.dtype((np.void, 16))
+
+    def __init__(self, rs, hs, values):
+        keys = self._to_keys(rs, hs)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._values = np.asarray(values)[order]
+
+    @classmethod
+    def _to_keys(cls, rs, hs):
+        # adding 0.0 turns -0.0 into 0.0, so both map to the same bytes
+        points = np.column_stack((np.asarray(rs, dtype=np.float64).ravel(), np.asarray(hs, dtype=np.float64).ravel()))
+        return np.ascontiguousarray(points + 0.0).view(cls._key_dtype).ravel()
+
+    def _indices(self, rs, hs):
+        """return the indices of the keys (r, h) and a boolean array telling which ones have been found"""
+        keys = self._to_keys(rs, hs)
+        idxs = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+        found = self._keys[idxs] == keys if len(self._keys) > 0 else np.zeros(len(keys), dtype=bool)
+        return idxs, found
+
+    def lookup(self, rs, hs, default=None):
+        """vectorized lookup of the values at the coordinates (rs, hs),
+        missing coordinates get the default value (or raise a KeyError if default is None)"""
+        idxs, found = self._indices(rs, hs)
+        if default is None:
+            if not found.all():
+                raise KeyError("Not all coordinates have a value.")
+            return self._values[idxs]
+        values = np.full(len(idxs), default, dtype=np.result_type(self._values, np.asarray(default)))
+        values[found] = self._values[idxs[found]]
+        return values
+
+    def get(self, point, default=None):
+        idxs, found = self._indices(point[0], point[1])
+        return self._values[idxs[0]] if found[0] else default
+
+    def __getitem__(self, point):
+        idxs, found = self._indices(point[0], point[1])
+        if not found[0]:
+            raise KeyError(point)
+        return self._values[idxs[0]]
+
+    def __contains__(self, point):
+        return bool(self._indices(point[0], point[1])[1][0])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        points = self._keys.view(np.float64).reshape(-1, 2)
+        return zip(points[:, 0].tolist(), points[:, 1].tolist())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self.keys(), self._values)
+
+
+def _rect_grid_points_and_values(grid, metadata, ignore_nodata=True, transform_func=None, row_col_value=False):
+    """compute the cell center points and the values of all (valid) cells of the grid in one pass
+    returns (points, values, rs, hs, grid_values) in row major order of the grid"""
 
     rows, cols = grid.shape
 
@@ -76,44 +474,249 @@ def create_interpolator_from_rect_grid(
     yll_center = yll + cellsize // 2
     yul_center = yll_center + (rows - 1) * cellsize
 
-    points = []
-    values = []
-    points_to_values = {}
+    if ignore_nodata:
+        row_idxs, col_idxs = np.nonzero(grid != nodata_value)
+    else:
+        row_idxs, col_idxs = np.divmod(np.arange(rows * cols), cols)
 
-    for row in range(rows):
-        for col in range(cols):
-            value = grid[row, col]
-            if ignore_nodata and value == nodata_value:
-                continue
-            r = xll_center + col * cellsize
-            h = yul_center - row * cellsize
+    grid_values = grid[row_idxs, col_idxs]
+    rs = xll_center + col_idxs * cellsize
+    hs = yul_center - row_idxs * cellsize
 
-            if transform_func:
-                r, h = transform_func(r, h)
+    if transform_func:
+        rs, hs = transform_func(rs, hs)
+        rs = np.asarray(rs)
+        hs = np.asarray(hs)
 
-            points.append([r, h])
-            values.append((row, col, value) if row_col_value else value)
+    points = np.column_stack((rs, hs))
+    values = np.column_stack((row_idxs, col_idxs, grid_values)) if row_col_value else grid_values
 
-            if not no_points_to_values:
-                points_to_values[(r, h)] = value
+    return points, values, rs, hs, grid_values
 
-    return NearestNDInterpolator(np.array(points), np.array(values)), None if no_points_to_values else points_to_values
 
+class RectGridInterpolator:
+    """Nearest neighbour lookup on a regular rectangular grid by index arithmetic.
+    Can be called like a scipy NearestNDInterpolator, either as f(rs, hs) or f(points),
+    but computes row/col directly from xllcorner, yllcorner and cellsize.
+    Queries hitting a nodata cell (or lying outside the grid) return the value of the valid cell
+    nearest to the hit (or closest border) cell, taken from a precomputed nearest-valid-index raster."""
 
-def interpolate_from_latlon(interpolator, interpolator_crs):
-    input_crs = CRS.from_epsg(4326)
-    transformer = Transformer.from_crs(input_crs, interpolator_crs, always_xy=True)
+    def __init__(self, grid, metadata, ignore_nodata=True, row_col_value=False):
+        self.grid = grid
+        self.metadata = metadata
+        self.row_col_value = row_col_value
+        self.nrows, self.ncols = grid.shape
+
+        self.cellsize = float(metadata["cellsize"])
+        self.xll = float(metadata["xllcorner"])
+        self.yul = float(metadata["yllcorner"]) + self.nrows * self.cellsize
+
+        # flat index of the nearest valid cell for every cell, None if every cell is valid
+        self.nearest_valid_index = None
+        if ignore_nodata:
+            invalid = grid == metadata["nodata_value"]
+            if invalid.all():
+                raise ValueError("grid contains only nodata values")
+            if invalid.any():
+                row_idxs, col_idxs = distance_transform_edt(invalid, return_distances=False, return_indices=True)
+                index_dtype = np.int32 if grid.size < np.iinfo(np.int32).max else np.int64
+                self.nearest_valid_index = (row_idxs * self.ncols + col_idxs).astype(index_dtype)
+
+    def row_col(self, rs, hs):
+        """return the (clipped) row and col arrays of the cells containing the points (rs, hs)"""
+        cols = np.floor((np.asarray(rs, dtype=np.float64) - self.xll) / self.cellsize)
+        rows = np.floor((self.yul - np.asarray(hs, dtype=np.float64)) / self.cellsize)
+        cols = np.clip(cols, 0, self.ncols - 1).astype(np.intp)
+        rows = np.clip(rows, 0, self.nrows - 1).astype(np.intp)
+        if self.nearest_valid_index is not None:
+            rows, cols = np.divmod(self.nearest_valid_index[rows, cols], self.ncols)
+        return rows, cols
+
+    def __call__(self, *args):
+        if len(args) == 2:
+            rs, hs = np.broadcast_arrays(np.asarray(args[0]), np.asarray(args[1]))
+        else:
+            xi = np.asarray(args[0])
+            rs, hs = xi[..., 0], xi[..., 1]
+        rows, cols = self.row_col(rs, hs)
+        values = self.grid[rows, cols]
+        if self.row_col_value:
+            return np.stack((rows, cols, values), axis=-1)
+        return values
+
+
+_GEOMETRY_HEADERS = ["ncols", "nrows", "xllcorner", "yllcorner", "cellsize"]
+
+
+class GridStack:
+    """Stack of aligned grids (same ncols, nrows, xllcorner, yllcorner and cellsize) stored as one
+    3D array (layers x rows x cols), so one query returns the values of all layers at once.
+    Cells outside the grid get the nodata value of each layer."""
+
+    def __init__(self, names, grids, metadata, nodata_values, crs=None):
+        self.names = list(names)
+        self.grids = grids
+        self.metadata = metadata
+        self.nodata_values = np.asarray(nodata_values, dtype=grids.dtype)
+        self.crs = crs
+        self.nrows = int(metadata["nrows"])
+        self.ncols = int(metadata["ncols"])
+        self.cellsize = float(metadata["cellsize"])
+        self.xll = float(metadata["xllcorner"])
+        self.yul = float(metadata["yllcorner"]) + self.nrows * self.cellsize
+
+    @classmethod
+    def from_ascii_grids(
+        cls,
+        name_to_path,
+        datatype=int,
+        crs=None,
+        max_workers=None,
+        path_to_stack_file=None,
+        block_rows=256,
+    ):
+        """load the esri ascii grids name_to_path = {name: path, ...} in parallel on a thread pool
+        datatype - one datatype or a dict {name: datatype}, the stack uses the common type of all
+        path_to_stack_file - if given, the stack is stored there as .npy file (plus .json sidecar)
+                             and memory mapped read-only, later calls reuse it as long as the grids didn't change"""
+        names = list(name_to_path.keys())
+        paths = [name_to_path[name] for name in names]
+        datatypes = [datatype.get(name, int) if isinstance(datatype, dict) else datatype for name in names]
+        dtype = np.result_type(*[np.dtype(dt) for dt in datatypes])
+        source_keys = [_source_file_key(path) for path in paths]
+        dtype_strs = [np.dtype(dt).str for dt in datatypes]
+
+        json_path = None
+        if path_to_stack_file:
+            json_path = Path(path_to_stack_file).with_name(Path(path_to_stack_file).name + ".json")
+            try:
+                with json_path.open() as _:
+                    stack_info = json.load(_)
+                if (
+                    stack_info["names"] == names
+                    and stack_info["sources"] == source_keys
+                    and stack_info["dtype"] == dtype.str
+                    and stack_info["datatypes"] == dtype_strs
+                ):
+                    grids = np.load(path_to_stack_file, mmap_mode="r")
+                    if grids.dtype == dtype and grids.shape[0] == len(names):
+                        return cls(names, grids, stack_info["metadata"], stack_info["nodata_values"], crs=crs)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        metadatas = [read_header(path)[0] for path in paths]
+        metadata = metadatas[0]
+        for name, md in zip(names, metadatas):
+            for header in _GEOMETRY_HEADERS:
+                if md.get(header) != metadata.get(header):
+                    raise ValueError(
+                        f"Grid {name} doesn't match the geometry of grid {names[0]} ({header}: "
+                        f"{md.get(header)} != {metadata.get(header)})."
+                    )
+        shape = (len(names), int(metadata["nrows"]), int(metadata["ncols"]))
+
+        def load_layers(grids):
+            def load_layer(i):
+                if dtype == np.dtype(datatypes[i]):
+                    with _open_ascii_grid(paths[i]) as _:
+                        md, lines_it = _read_header_and_body_lines_from(_)
+                        _parse_ascii_grid_rows_into(grids[i], lines_it, shape[2], paths[i], block_rows=block_rows)
+                else:
+                    grids[i] = read_ascii_grid(paths[i], datatype=datatypes[i], block_rows=block_rows)[0]
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(load_layer, range(len(names))))
+
+        def write_stack_file(f):
+            grids = np.lib.format.open_memmap(f.name, mode="w+", dtype=dtype, shape=shape)
+            load_layers(grids)
+            grids.flush()
+            del grids
+
+        nodata_values = [md.get("nodata_value", -9999) for md in metadatas]
+        geometry = {header: metadata[header] for header in _GEOMETRY_HEADERS}
+        if path_to_stack_file:
+            atomic_write(path_to_stack_file, write_stack_file)
+            stack_info = {
+                "names": names,
+                "sources": source_keys,
+                "dtype": dtype.str,
+                "datatypes": dtype_strs,
+                "metadata": geometry,
+                "nodata_values": nodata_values,
+            }
+            atomic_write(json_path, lambda f: json.dump(stack_info, f), mode="w")
+            grids = np.load(path_to_stack_file, mmap_mode="r")
+        else:
+            grids = np.empty(shape, dtype=dtype)
+            load_layers(grids)
+
+        return cls(names, grids, geometry, nodata_values, crs=crs)
+
+    def __getitem__(self, name):
+        """the 2D grid of layer name"""
+        return self.grids[self.names.index(name)]
+
+    def row_col(self, rs, hs):
+        """return rows, cols and a boolean mask of the points (rs, hs) lying inside the grid"""
+        cols = np.floor((np.asarray(rs, dtype=np.float64) - self.xll) / self.cellsize).astype(np.intp)
+        rows = np.floor((self.yul - np.asarray(hs, dtype=np.float64)) / self.cellsize).astype(np.intp)
+        inside = (rows >= 0) & (rows < self.nrows) & (cols >= 0) & (cols < self.ncols)
+        return rows, cols, inside
+
+    def values_at(self, rs, hs):
+        """return the values of all layers at the point(s) (rs, hs) given in the grid's CRS,
+        shape is (layers,) for a single point and (points, layers) for arrays of points"""
+        rows, cols, inside = self.row_col(rs, hs)
+        values = np.broadcast_to(self.nodata_values, np.shape(rows) + (len(self.names),)).copy()
+        values[inside] = self.grids[:, rows[inside], cols[inside]].T
+        return values
+
+    def values_at_latlon(self, lats, lons):
+        """like values_at, but for lat/lon coordinates, needs the stack's crs"""
+        if self.crs is None:
+            raise ValueError("GridStack needs a crs to be queried by lat/lon.")
+        rs, hs = crsr.get_transformer(crsr.WGS84, self.crs).transform(lons, lats)
+        return self.values_at(rs, hs)
 
+    def value_dict_at(self, r, h):
+        """return {layer name: value} at the point (r, h)"""
+        return dict(zip(self.names, self.values_at(r, h).tolist()))
+
+
+def interpolate_from_latlon(interpolator, interpolator_crs):
     def interpol(lat, lon):
-        r, h = transformer.transform(lon, lat)
+        r, h = crsr.get_transformer(crsr.WGS84, interpolator_crs).transform(lon, lat)
         return interpolator(r, h)
 
     return interpol
 
 
+def interpolate_from_latlon_batched(interpolator, interpolator_crs, chunk_size=100000):
+    """like interpolate_from_latlon, but the returned function takes arrays of lats and lons
+    and returns an array of values, the input is transformed and queried in chunks of chunk_size points
+    with one pyproj call and one vectorized interpolator query per chunk"""
+
+    def interpol(lats, lons):
+        transformer = crsr.get_transformer(crsr.WGS84, interpolator_crs)
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        lats = lats.ravel()
+        lons = lons.ravel()
+        values = None
+        for start in range(0, len(lats), chunk_size):
+            end = min(start + chunk_size, len(lats))
+            rs, hs = transformer.transform(lons[start:end], lats[start:end])
+            chunk_values = np.asarray(interpolator(rs, hs))
+            if values is None:
+                values = np.empty((len(lats),) + chunk_values.shape[1:], dtype=chunk_values.dtype)
+            values[start:end] = chunk_values
+        return values if values is not None else np.empty(0)
+
+    return interpol
+
+
 def rect_coordinates_to_latlon(rect_crs, coords):
-    latlon_crs = CRS.from_epsg(4326)
-    transformer = Transformer.from_crs(rect_crs, latlon_crs, always_xy=True)
+    transformer = crsr.get_transformer(rect_crs, crsr.WGS84)
 
     rs, hs = zip(*coords)
     lons, lats = transformer.transform(list(rs), list(hs))
@@ -122,27 +725,182 @@ def rect_coordinates_to_latlon(rect_crs, coords):
     return latlons
 
 
-def create_interpolator_from_ascii_grid(path_to_ascii_grid, datatype=int, no_of_header_rows=6, ignore_nodata=True):
-    grid, metadata = load_grid_and_metadata_from_ascii_grid(path_to_ascii_grid, datatype, no_of_header_rows)
-    return create_interpolator_from_rect_grid(grid, metadata, ignore_nodata)
+def create_interpolator_from_ascii_grid(
+    path_to_ascii_grid,
+    datatype=int,
+    no_of_header_rows=None,
+    ignore_nodata=True,
+    use_index_cache=False,
+    index_cache_dir=None,
+):
+    """create interpolator from esri ascii grid file
+    use_index_cache - store the built interpolator in the user's private cache directory (or in index_cache_dir)
+                      and load it from there on later calls without reading the grid at all"""
+
+    def create():
+        grid, metadata = load_grid_and_metadata_from_ascii_grid(path_to_ascii_grid, datatype, no_of_header_rows)
+        return create_interpolator_from_rect_grid(grid, metadata, ignore_nodata)
+
+    if use_index_cache:
+        options = {"datatype": np.dtype(datatype).str, "ignore_nodata": ignore_nodata}
+        return load_or_create_interpolator_index(path_to_ascii_grid, options, create, index_cache_dir)
+    return create()
 
 
-def load_grid_and_metadata_from_ascii_grid(path_to_ascii_grid, datatype=int, no_of_header_rows=6):
-    metadata, _ = read_header(path_to_ascii_grid)
-    grid = np.loadtxt(path_to_ascii_grid, dtype=datatype, skiprows=no_of_header_rows)
+def _index_library_versions():
+    # pickled indices depend on the classes of the libraries they have been built with
+    return {"numpy": np.__version__, "scipy": scipy.__version__}
+
+
+def interpolator_index_cache_key(path_to_source_file, options=None):
+    """key identifying an interpolator index built from path_to_source_file with the given construction options"""
+    return {
+        **_source_file_key(path_to_source_file),
+        "options": {str(k): str(v) for k, v in sorted((options or {}).items())},
+        **_index_library_versions(),
+    }
+
+
+def interpolator_index_cache_path(path_to_source_file, options=None, index_cache_dir=None):
+    """path of the index file for the given source file and construction options,
+    by default in the user's private cache directory, as index files are unpickled"""
+    path = Path(path_to_source_file).resolve()
+    key_str = json.dumps([str(path), interpolator_index_cache_key(path, options)["options"]])
+    key_hash = hashlib.sha1(key_str.encode()).hexdigest()[:16]
+    return Path(index_cache_dir or private_cache_dir("interpolator_indices")) / f"{path.name}.{key_hash}.index.pickle"
+
+
+def save_interpolator_index(interpolator, path_to_index_file, key=None):
+    """store the built interpolator (a NearestNDInterpolator including its KD-tree or any
+    other picklable object, e.g. a tuple of interpolator and lookup dict) together with its key,
+    the file is replaced atomically"""
+
+    def write(f):
+        pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(interpolator, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        atomic_write(path_to_index_file, write)
+    except (OSError, pickle.PicklingError) as e:
+        logger.warning("Couldn't write interpolator index %s: %s", path_to_index_file, e)
+
+
+def load_interpolator_index(path_to_index_file, key=None):
+    """load an interpolator stored with save_interpolator_index, returns None if there is
+    no index file or it has been stored with a different key
+    as index files are unpickled, files not owned by the current user or writable by others are ignored"""
+    try:
+        if not is_private_file(path_to_index_file):
+            logger.warning("Ignoring interpolator index %s, it isn't private to the current user.", path_to_index_file)
+            return None
+        with Path(path_to_index_file).open("rb") as _:
+            if pickle.load(_) != key:
+                return None
+            return pickle.load(_)
+    except FileNotFoundError:
+        return None
+    except Exception as e:  # noqa: BLE001
+        # e.g. pickles of other library versions referencing classes or modules which don't exist anymore
+        logger.warning("Couldn't load interpolator index %s, it will be rebuilt: %s", path_to_index_file, e)
+        return None
+
+
+def load_or_create_interpolator_index(path_to_source_file, options, create, index_cache_dir=None):
+    """load the interpolator index for path_to_source_file and options or create it by calling create()
+    and store it for later calls"""
+    key = interpolator_index_cache_key(path_to_source_file, options)
+    path_to_index_file = interpolator_index_cache_path(path_to_source_file, options, index_cache_dir)
+    interpolator = load_interpolator_index(path_to_index_file, key)
+    if interpolator is None:
+        interpolator = create()
+        save_interpolator_index(interpolator, path_to_index_file, key)
+    return interpolator
+
+
+def load_grid_and_metadata_from_ascii_grid(
+    path_to_ascii_grid, datatype=int, no_of_header_rows=None, use_binary_cache=False, cache_dir=None
+):
+    """load grid and metadata from esri ascii grid file
+    use_binary_cache - on first load store the grid as .npy file (plus header as .json) next to the grid file
+                       or in cache_dir and memory map this file read-only on later loads"""
+    if use_binary_cache:
+        cached = _load_from_binary_cache(path_to_ascii_grid, datatype, cache_dir)
+        if cached:
+            return cached
+
+    grid, metadata = read_ascii_grid(path_to_ascii_grid, datatype=datatype, no_of_header_lines=no_of_header_rows)
+
+    if use_binary_cache:
+        _write_binary_cache(path_to_ascii_grid, datatype, cache_dir, grid, metadata)
     return (grid, metadata)
 
 
-def load_grid_cached(path_to_grid, val_type, print_path=False):
-    if not hasattr(load_grid_cached, "cache"):
-        load_grid_cached.cache = {}
+def _binary_cache_paths(path_to_ascii_grid, datatype, cache_dir=None):
+    """return the paths to the .npy and .json file of the binary cache of the given grid file"""
+    path = Path(path_to_ascii_grid).resolve()
+    dtype_name = np.dtype(datatype).name
+    if cache_dir:
+        # avoid collisions of equally named grids in different directories
+        path_hash = hashlib.sha1(str(path).encode()).hexdigest()[:16]
+        base = Path(cache_dir) / f"{path.name}.{path_hash}.{dtype_name}"
+    else:
+        base = path.with_name(f"{path.name}.{dtype_name}")
+    return base.with_name(base.name + ".npy"), base.with_name(base.name + ".json")
 
-    if path_to_grid in load_grid_cached.cache:
-        return load_grid_cached.cache[path_to_grid]
 
-    md, _ = read_header(path_to_grid)
-    grid = np.loadtxt(path_to_grid, dtype=type, skiprows=len(md))
-    print("read: ", path_to_grid)
+def _source_file_key(path_to_file):
+    """identity of a source file for caches derived from it"""
+    path = Path(path_to_file).resolve()
+    st = path.stat()
+    return {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def _binary_cache_key(path_to_ascii_grid, datatype):
+    return {**_source_file_key(path_to_ascii_grid), "dtype": np.dtype(datatype).str}
+
+
+def _load_from_binary_cache(path_to_ascii_grid, datatype, cache_dir=None):
+    """return (memory mapped grid, metadata) if a valid binary cache exists, else None"""
+    npy_path, json_path = _binary_cache_paths(path_to_ascii_grid, datatype, cache_dir)
+    try:
+        with json_path.open() as _:
+            cache_info = json.load(_)
+        if cache_info["key"] != _binary_cache_key(path_to_ascii_grid, datatype):
+            return None
+        grid = np.load(npy_path, mmap_mode="r")
+        if list(grid.shape) != cache_info["shape"]:
+            return None
+        return grid, cache_info["metadata"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_binary_cache(path_to_ascii_grid, datatype, cache_dir, grid, metadata):
+    """write grid and metadata to the binary cache, files are replaced atomically
+    so concurrent readers never see partially written files"""
+    npy_path, json_path = _binary_cache_paths(path_to_ascii_grid, datatype, cache_dir)
+    cache_info = {
+        "key": _binary_cache_key(path_to_ascii_grid, datatype),
+        "shape": list(grid.shape),
+        "metadata": metadata,
+    }
+    try:
+        save_npy_and_json(npy_path, json_path, grid, cache_info)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't write binary cache for grid %s: %s", path_to_ascii_grid, e)
+
+
+def _create_grid_cache_entry(path_to_grid, val_type, use_binary_cache=False, cache_dir=None):
+    grid, md = load_grid_and_metadata_from_ascii_grid(
+        path_to_grid,
+        datatype=val_type,
+        use_binary_cache=use_binary_cache,
+        cache_dir=cache_dir,
+    )
     ll0r = get_lat_0_lon_0_resolution_from_grid_metadata(md)
 
     def col(lon):
@@ -160,7 +918,7 @@ def load_grid_cached(path_to_grid, val_type, print_path=False):
                 return val
         return None
 
-    cache_entry = {
+    return {
         "metadata": md,
         "grid": grid,
         "ll0r": ll0r,
@@ -168,33 +926,570 @@ def load_grid_cached(path_to_grid, val_type, print_path=False):
         "row": lambda lat: row(lat),
         "value": lambda lat, lon, ret_no_data: value(lat, lon, ret_no_data),
     }
-    load_grid_cached.cache[path_to_grid] = cache_entry
-    return cache_entry
+
+
+class GridCache:
+    """Thread-safe LRU cache of loaded grids.
+    Grids are evicted least recently used first as soon as the sum of their sizes exceeds max_bytes
+    (None = unbounded). Concurrent first loads of the same grid share a single load."""
+
+    def __init__(self, max_bytes=None, use_binary_cache=False, cache_dir=None):
+        self._max_bytes = max_bytes
+        self._use_binary_cache = use_binary_cache
+        self._cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._entry_bytes = {}
+        self._loading_locks = {}
+        # bumped by invalidate/clear, so loads which were in flight at that time aren't cached afterwards
+        self._generations = {}
+        self._clear_generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def _get_cached(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def _evict(self, keep=None):
+        while self._max_bytes is not None and self.bytes > self._max_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            del self._entries[key]
+            self.bytes -= self._entry_bytes.pop(key)
+            self.evictions += 1
+
+    def _generation(self, path_to_grid):
+        return self._clear_generation, self._generations.get(path_to_grid, 0)
+
+    def get(self, path_to_grid, val_type, print_path=False, use_binary_cache=None, cache_dir=None):
+        """return the cache entry (see load_grid_cached) for the grid at path_to_grid, load it if necessary"""
+        key = (path_to_grid, val_type)
+        with self._lock:
+            entry = self._get_cached(key)
+            if entry is not None:
+                return entry
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        with loading_lock:
+            with self._lock:
+                entry = self._get_cached(key)
+                if entry is not None:
+                    return entry
+                self.misses += 1
+                generation = self._generation(path_to_grid)
+
+            try:
+                entry = _create_grid_cache_entry(
+                    path_to_grid,
+                    val_type,
+                    use_binary_cache=self._use_binary_cache if use_binary_cache is None else use_binary_cache,
+                    cache_dir=cache_dir or self._cache_dir,
+                )
+            except BaseException:
+                with self._lock:
+                    if self._loading_locks.get(key) is loading_lock:
+                        del self._loading_locks[key]
+                raise
+            if print_path:
+                logger.info("read: %s", path_to_grid)
+
+            with self._lock:
+                # the grid has been invalidated while it was loading, so don't cache the possibly stale entry
+                if self._generation(path_to_grid) == generation:
+                    self._entries[key] = entry
+                    self._entry_bytes[key] = entry["grid"].nbytes
+                    self.bytes += entry["grid"].nbytes
+                    self._evict(keep=key)
+                if self._loading_locks.get(key) is loading_lock:
+                    del self._loading_locks[key]
+            return entry
+
+    async def get_async(self, path_to_grid, val_type, print_path=False, use_binary_cache=None, cache_dir=None):
+        """like get, but loads the grid in the default executor of the running event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get, path_to_grid, val_type, print_path, use_binary_cache, cache_dir
+        )
+
+    def invalidate(self, path_to_grid):
+        """remove all cached entries for the grid at path_to_grid"""
+        with self._lock:
+            self._generations[path_to_grid] = self._generations.get(path_to_grid, 0) + 1
+            for key in [k for k in self._entries if k[0] == path_to_grid]:
+                del self._entries[key]
+                self.bytes -= self._entry_bytes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._clear_generation += 1
+            self._entries.clear()
+            self._entry_bytes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self.bytes,
+                "entries": len(self._entries),
+            }
+
+
+# the cache used by load_grid_cached, set grid_cache.max_bytes to bound its memory use
+grid_cache = GridCache()
+
+
+def load_grid_cached(path_to_grid, val_type, print_path=False, use_binary_cache=None, cache_dir=None):
+    """load grid via the module wide grid_cache and return a dict with
+    metadata, grid, ll0r and col(lon), row(lat), value(lat, lon, ret_no_data) accessors
+    use_binary_cache, cache_dir - override the settings of grid_cache if given"""
+    return grid_cache.get(
+        path_to_grid, val_type, print_path=print_path, use_binary_cache=use_binary_cache, cache_dir=cache_dir
+    )
+
+
+def _cell_center_chunks(metadata, chunk_size=1000000):
+    """yield (row_start, row_end, rs, hs) with the cell center coordinates of chunks of whole rows
+    of the grid described by metadata, each chunk has about chunk_size cells"""
+    nrows = int(metadata["nrows"])
+    ncols = int(metadata["ncols"])
+    cellsize = float(metadata["cellsize"])
+    col_rs = float(metadata["xllcorner"]) + (np.arange(ncols) + 0.5) * cellsize
+    yul = float(metadata["yllcorner"]) + nrows * cellsize
+    chunk_rows = max(1, chunk_size // max(ncols, 1))
+    for row_start in range(0, nrows, chunk_rows):
+        row_end = min(row_start + chunk_rows, nrows)
+        row_hs = yul - (np.arange(row_start, row_end) + 0.5) * cellsize
+        rs, hs = np.meshgrid(col_rs, row_hs)
+        yield row_start, row_end, rs, hs
+
+
+def map_rect_grid_to_rect_grid(source_metadata, source_crs, target_metadata, target_crs, chunk_size=1000000):
+    """map every cell of the source grid to the target grid cell containing its center
+    returns an int array shaped like the source grid with the flat index (row * ncols + col) of the
+    target cell, -1 if the center lies outside the target grid, use np.divmod(mapping, ncols) to get row/col"""
+    transformer = crsr.get_transformer(source_crs, target_crs)
+    t_nrows = int(target_metadata["nrows"])
+    t_ncols = int(target_metadata["ncols"])
+    t_cellsize = float(target_metadata["cellsize"])
+    t_xll = float(target_metadata["xllcorner"])
+    t_yul = float(target_metadata["yllcorner"]) + t_nrows * t_cellsize
+    index_dtype = np.int32 if t_nrows * t_ncols < np.iinfo(np.int32).max else np.int64
+
+    mapping = np.empty((int(source_metadata["nrows"]), int(source_metadata["ncols"])), dtype=index_dtype)
+    for row_start, row_end, rs, hs in _cell_center_chunks(source_metadata, chunk_size):
+        trs, ths = transformer.transform(rs, hs)
+        cols = np.floor((trs - t_xll) / t_cellsize)
+        rows = np.floor((t_yul - ths) / t_cellsize)
+        inside = (rows >= 0) & (rows < t_nrows) & (cols >= 0) & (cols < t_ncols)
+        mapping[row_start:row_end] = np.where(inside, rows * t_ncols + cols, -1)
+    return mapping
+
+
+def map_rect_grid_to_interpolator(
+    source_metadata, source_crs, interpolator, interpolator_crs, dtype=np.int32, chunk_size=1000000
+):
+    """map every cell center of the source grid through the given (nearest neighbour) interpolator,
+    e.g. one created by create_climate_geoGrid_interpolator_from_json_file returning (row, col) pairs
+    returns an array shaped (source rows, source cols, ...) of the interpolator values cast to dtype"""
+    transformer = crsr.get_transformer(source_crs, interpolator_crs)
+    mapping = None
+    for row_start, row_end, rs, hs in _cell_center_chunks(source_metadata, chunk_size):
+        trs, ths = transformer.transform(rs.ravel(), hs.ravel())
+        values = np.asarray(interpolator(trs, ths))
+        values = values.reshape(rs.shape + values.shape[1:])
+        if mapping is None:
+            mapping = np.empty(
+                (int(source_metadata["nrows"]), int(source_metadata["ncols"])) + values.shape[2:], dtype=dtype
+            )
+        mapping[row_start:row_end] = values
+    return mapping
+
+
+def _load_cached_array(path_to_npy_file, key):
+    """return the memory mapped array stored with _save_cached_array if its key matches, else None"""
+    try:
+        with Path(f"{path_to_npy_file}.json").open() as _:
+            if json.load(_) != key:
+                return None
+        return np.load(path_to_npy_file, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached_array(path_to_npy_file, key, array):
+    """store array as .npy and its key as .json sidecar, files are replaced atomically"""
+    try:
+        save_npy_and_json(path_to_npy_file, f"{path_to_npy_file}.json", array, key)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't write cached array %s: %s", path_to_npy_file, e)
+
+
+def load_or_create_grid_mapping(path_to_source_file, path_to_target_file, create, options=None, cache_dir=None):
+    """load the mapping array between the source and target files (and options) from the cache
+    or create it by calling create() and store it, the cache is keyed by both files' path, size and mtime
+    the mapping is stored next to the source file if no cache_dir is given and returned memory mapped"""
+    key = {
+        "source": _source_file_key(path_to_source_file),
+        "target": _source_file_key(path_to_target_file),
+        "options": {str(k): str(v) for k, v in sorted((options or {}).items())},
+    }
+    source_path = Path(path_to_source_file).resolve()
+    key_hash = hashlib.sha1(json.dumps([key["source"]["path"], key["target"]["path"], key["options"]]).encode())
+    path_to_npy_file = Path(cache_dir or source_path.parent) / f"{source_path.name}.{key_hash.hexdigest()[:16]}.map.npy"
+
+    mapping = _load_cached_array(path_to_npy_file, key)
+    if mapping is None:
+        mapping = create()
+        _save_cached_array(path_to_npy_file, key, mapping)
+    return mapping
+
+
+def create_grid_to_grid_mapping(path_to_source_grid, source_crs, path_to_target_grid, target_crs, cache_dir=None):
+    """map every cell of the source esri ascii grid to the flat index of the target grid cell containing its center
+    (see map_rect_grid_to_rect_grid), only the headers are read and the result is cached on disk"""
+
+    def create():
+        source_metadata, _ = read_header(path_to_source_grid)
+        target_metadata, _ = read_header(path_to_target_grid)
+        return map_rect_grid_to_rect_grid(source_metadata, source_crs, target_metadata, target_crs)
+
+    options = {
+        "source_crs": crsr.get_crs(source_crs).to_wkt(),
+        "target_crs": crsr.get_crs(target_crs).to_wkt(),
+    }
+    return load_or_create_grid_mapping(path_to_source_grid, path_to_target_grid, create, options, cache_dir)
+
+
+def create_grid_to_latlon_rowcol_mapping(
+    path_to_source_grid, source_crs, path_to_latlon_to_rowcol_file, target_crs, cache_dir=None
+):
+    """map every cell of the source esri ascii grid to the (row, col) of the nearest cell of a json list of
+    lat/lon to row/col mappings (as used by create_climate_geoGrid_interpolator_from_json_file),
+    the distance is measured in target_crs, returns an int32 array (source rows, source cols, 2) cached on disk"""
+
+    def create():
+        source_metadata, _ = read_header(path_to_source_grid)
+        interpolator = create_climate_geoGrid_interpolator_from_json_file(
+            path_to_latlon_to_rowcol_file, crsr.WGS84, target_crs, {}
+        )
+        return map_rect_grid_to_interpolator(source_metadata, source_crs, interpolator, target_crs)
+
+    options = {
+        "source_crs": crsr.get_crs(source_crs).to_wkt(),
+        "target_crs": crsr.get_crs(target_crs).to_wkt(),
+    }
+    return load_or_create_grid_mapping(path_to_source_grid, path_to_latlon_to_rowcol_file, create, options, cache_dir)
+
+
+def overview_metadata(metadata, factor):
+    """return the metadata of the overview of a grid where factor x factor cells are aggregated into one,
+    incomplete blocks at the right and bottom border are kept, so the upper left corner stays the same"""
+    nrows = int(metadata["nrows"])
+    ncols = int(metadata["ncols"])
+    cellsize = float(metadata["cellsize"])
+    o_nrows = -(-nrows // factor)
+    o_cellsize = cellsize * factor
+    yul = float(metadata["yllcorner"]) + nrows * cellsize
+    return {
+        **metadata,
+        "ncols": float(-(-ncols // factor)),
+        "nrows": float(o_nrows),
+        "yllcorner": yul - o_nrows * o_cellsize,
+        "cellsize": o_cellsize,
+    }
+
+
+def create_overview(grid, metadata, factor, aggregation="mean", min_valid_fraction=0.0):
+    """aggregate blocks of factor x factor cells of the grid into one cell ignoring nodata cells
+    aggregation - "mean" for continuous values, "mode" (most frequent value, smallest one on ties)
+                  for categorical values like soil ids, "count" for the number of valid cells
+    min_valid_fraction - blocks with a lower fraction of valid cells (or without any) become nodata
+                         (except for "count")
+    returns (overview grid, overview metadata)"""
+    if aggregation not in ["mean", "mode", "count"]:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+    nrows, ncols = grid.shape
+    nodata_value = metadata["nodata_value"]
+    o_md = overview_metadata(metadata, factor)
+    o_nrows = int(o_md["nrows"])
+    o_ncols = int(o_md["ncols"])
+
+    # pad to whole blocks and reshape to (o_nrows, o_ncols, factor * factor)
+    padded = np.full((o_nrows * factor, o_ncols * factor), nodata_value, dtype=grid.dtype)
+    padded[:nrows, :ncols] = grid
+    blocks = padded.reshape(o_nrows, factor, o_ncols, factor).swapaxes(1, 2).reshape(o_nrows, o_ncols, -1)
+    del padded
+    valid = blocks != nodata_value
+    counts = valid.sum(axis=2)
+    if aggregation == "count":
+        return counts.astype(np.int32), o_md
+
+    insufficient = (counts == 0) | (counts < min_valid_fraction * factor * factor)
+    if aggregation == "mean":
+        dtype = grid.dtype if np.issubdtype(grid.dtype, np.floating) else np.float64
+        sums = np.where(valid, blocks, 0).sum(axis=2, dtype=np.float64)
+        overview = (sums / np.maximum(counts, 1)).astype(dtype)
+    else:
+        flat_blocks = blocks.reshape(o_nrows * o_ncols, -1)
+        block_ids = np.nonzero(valid.reshape(o_nrows * o_ncols, -1))[0]
+        values = flat_blocks[valid.reshape(o_nrows * o_ncols, -1)]
+        # count every (block, value) pair, then pick the most frequent value per block
+        order = np.lexsort((values, block_ids))
+        block_ids = block_ids[order]
+        values = values[order]
+        new_pair = np.ones(len(values), dtype=bool)
+        new_pair[1:] = (block_ids[1:] != block_ids[:-1]) | (values[1:] != values[:-1])
+        starts = np.flatnonzero(new_pair)
+        pair_counts = np.diff(np.append(starts, len(values)))
+        pair_blocks = block_ids[starts]
+        pair_values = values[starts]
+        order = np.lexsort((pair_values, -pair_counts, pair_blocks))
+        first_of_block = np.ones(len(order), dtype=bool)
+        first_of_block[1:] = pair_blocks[order][1:] != pair_blocks[order][:-1]
+        overview = np.full(o_nrows * o_ncols, nodata_value, dtype=grid.dtype)
+        overview[pair_blocks[order][first_of_block]] = pair_values[order][first_of_block]
+        overview = overview.reshape(o_nrows, o_ncols)
+    overview[insufficient] = nodata_value
+    return overview, o_md
+
+
+class GridPyramid:
+    """Overviews of a loaded grid, each level (factor, aggregation) is created once and kept."""
+
+    def __init__(self, grid, metadata, min_valid_fraction=0.0):
+        self.grid = grid
+        self.metadata = metadata
+        self.min_valid_fraction = min_valid_fraction
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, factor, aggregation="mean"):
+        """return (overview grid, overview metadata) for the given factor and aggregation"""
+        if factor == 1:
+            return self.grid, self.metadata
+        key = (factor, aggregation)
+        with self._lock:
+            if key not in self._levels:
+                self._levels[key] = create_overview(
+                    self.grid, self.metadata, factor, aggregation, min_valid_fraction=self.min_valid_fraction
+                )
+            return self._levels[key]
+
+
+def load_overview_from_ascii_grid(
+    path_to_ascii_grid, factor, aggregation="mean", datatype=int, min_valid_fraction=0.0, cache_dir=None
+):
+    """return (overview grid, overview metadata) of the esri ascii grid (see create_overview),
+    the overview is cached as .npy file next to the grid (or in cache_dir) and memory mapped on later calls,
+    so these don't touch the full resolution data"""
+    metadata, _ = read_header(path_to_ascii_grid)
+    o_md = overview_metadata(metadata, factor)
+    key = {
+        **_binary_cache_key(path_to_ascii_grid, datatype),
+        "factor": factor,
+        "aggregation": aggregation,
+        "min_valid_fraction": min_valid_fraction,
+    }
+    path = Path(path_to_ascii_grid).resolve()
+    name = f"{path.name}.{np.dtype(datatype).name}.overview-{factor}-{aggregation}-{min_valid_fraction}.npy"
+    path_to_npy_file = Path(cache_dir) / name if cache_dir else path.with_name(name)
+
+    overview = _load_cached_array(path_to_npy_file, key)
+    if overview is None:
+        grid, metadata = read_ascii_grid(path_to_ascii_grid, datatype=datatype)
+        overview, o_md = create_overview(grid, metadata, factor, aggregation, min_valid_fraction)
+        _save_cached_array(path_to_npy_file, key, overview)
+    return overview, o_md
+
+
+def _z_order_keys(rows, cols, bits):
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for bit in range(bits):
+        keys |= ((cols >> bit) & 1) << (2 * bit)
+        keys |= ((rows >> bit) & 1) << (2 * bit + 1)
+    return keys
+
+
+def _hilbert_keys(rows, cols, bits):
+    n = 1 << bits
+    x = cols.astype(np.int64)
+    y = rows.astype(np.int64)
+    keys = np.zeros(len(rows), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return keys
+
+
+def valid_cell_index(grid, metadata=None, order="row", nodata_value=None):
+    """return the flat indices (row * ncols + col) of all valid (not nodata) cells of the grid
+    order - "row" for row major order, "z" for Z-order (Morton) or "hilbert" for Hilbert curve order,
+            the latter two keep neighbouring cells close together when walking the cells
+    use np.divmod(index, ncols) to get the rows and cols"""
+    if nodata_value is None and metadata is not None:
+        nodata_value = metadata["nodata_value"]
+    flat_idxs = np.flatnonzero(grid != nodata_value) if nodata_value is not None else np.arange(grid.size)
+    if order == "row":
+        return flat_idxs
+    rows, cols = np.divmod(flat_idxs, grid.shape[1])
+    bits = max(int(max(grid.shape) - 1).bit_length(), 1)
+    if order == "z":
+        keys = _z_order_keys(rows, cols, bits)
+    elif order == "hilbert":
+        keys = _hilbert_keys(rows, cols, bits)
+    else:
+        raise ValueError(f"Unknown cell order: {order}")
+    return flat_idxs[np.argsort(keys, kind="stable")]
+
+
+def iterate_valid_cells(grid, metadata=None, order="row", cell_index=None):
+    """yield (row, col, value) of all valid cells of the grid in the given order (see valid_cell_index)
+    or in the order of a precomputed cell_index"""
+    if cell_index is None:
+        cell_index = valid_cell_index(grid, metadata, order)
+    rows, cols = np.divmod(cell_index, grid.shape[1])
+    yield from zip(rows.tolist(), cols.tolist(), grid[rows, cols].tolist())
+
+
+def generate_cell_setups(
+    grids, mappings=None, chunk_size=100000, skip_nodata=True, crs=None, order="row", cell_index=None
+):
+    """generate per cell setup records over aligned grids in array backed chunks
+    grids - {name: (grid, metadata), ...} of aligned grids or a GridStack
+    mappings - optional {name: mapping array, ...} shaped (rows, cols) or (rows, cols, k) like the grids,
+               e.g. created by create_grid_to_grid_mapping or create_grid_to_latlon_rowcol_mapping
+    skip_nodata - skip cells where any grid has its nodata value or any (rows, cols) mapping is -1
+    crs - if given, add the lat/lon of the cell centers to the records
+    order - order to walk the cells in, "row", "z" or "hilbert" (see valid_cell_index)
+    cell_index - precomputed flat indices of the cells to walk (in this order), replaces the nodata mask and order
+    yields dicts {"row": rows, "col": cols, name: values, ...} of numpy arrays with at most chunk_size cells each"""
+    if isinstance(grids, GridStack):
+        metadata = grids.metadata
+        layers = [(name, grids.grids[i], grids.nodata_values[i]) for i, name in enumerate(grids.names)]
+    else:
+        metadata = next(iter(grids.values()))[1]
+        layers = []
+        for name, (grid, md) in grids.items():
+            for header in _GEOMETRY_HEADERS:
+                if md.get(header) != metadata.get(header):
+                    raise ValueError(f"Grid {name} doesn't match the geometry of the other grids ({header}).")
+            layers.append((name, grid, md.get("nodata_value")))
+    mappings = mappings or {}
+    nrows = int(metadata["nrows"])
+    ncols = int(metadata["ncols"])
+    for name, mapping in mappings.items():
+        if mapping.shape[:2] != (nrows, ncols):
+            raise ValueError(f"Mapping {name} doesn't have the shape of the grids.")
+
+    if cell_index is not None:
+        flat_idxs = np.asarray(cell_index)
+    else:
+        valid = np.ones((nrows, ncols), dtype=bool)
+        if skip_nodata:
+            for _name, grid, nodata_value in layers:
+                if nodata_value is not None:
+                    valid &= grid != nodata_value
+            for mapping in mappings.values():
+                if mapping.ndim == 2:
+                    valid &= mapping != -1
+        # valid is a boolean mask, so False is the value of the cells to skip
+        flat_idxs = valid_cell_index(valid, order=order, nodata_value=False)
+        del valid
+
+    transformer = None
+    if crs is not None:
+        transformer = crsr.get_transformer(crs, crsr.WGS84)
+        cellsize = float(metadata["cellsize"])
+        xll = float(metadata["xllcorner"])
+        yul = float(metadata["yllcorner"]) + nrows * cellsize
+
+    for start in range(0, len(flat_idxs), chunk_size):
+        rows, cols = np.divmod(flat_idxs[start : start + chunk_size], ncols)
+        chunk = {"row": rows, "col": cols}
+        for name, grid, _nodata_value in layers:
+            chunk[name] = grid[rows, cols]
+        for name, mapping in mappings.items():
+            chunk[name] = mapping[rows, cols]
+        if transformer:
+            lons, lats = transformer.transform(xll + (cols + 0.5) * cellsize, yul - (rows + 0.5) * cellsize)
+            chunk["lat"] = lats
+            chunk["lon"] = lons
+        yield chunk
 
 
 def create_climate_geoGrid_interpolator_from_json_file(
-    path_to_latlon_to_rowcol_file, worldGeodeticSys84, geoTargetGrid, cdict
+    path_to_latlon_to_rowcol_file,
+    worldGeodeticSys84,
+    geoTargetGrid,
+    cdict,
+    use_index_cache=False,
+    index_cache_dir=None,
 ):
-    "create interpolator from json list of lat/lon to row/col mappings"
-    with open(path_to_latlon_to_rowcol_file) as _:
-        points = []
-        values = []
+    """create interpolator from json list of lat/lon to row/col mappings
+    use_index_cache - store the built interpolator in the user's private cache directory (or in index_cache_dir)
+                      and load it from there on later calls"""
 
-        transformer = Transformer.from_crs(worldGeodeticSys84, geoTargetGrid, always_xy=True)
+    def create():
+        rowcol_to_latlon = {}
+        with open(path_to_latlon_to_rowcol_file) as _:
+            points = []
+            values = []
 
-        for latlon, rowcol in json.load(_):
-            row, col = rowcol
-            clat, clon = latlon
-            try:
-                cr_geoTargetGrid, ch_geoTargetGrid = transformer.transform(clon, clat)
-                cdict[(row, col)] = (round(clat, 4), round(clon, 4))
-                points.append([cr_geoTargetGrid, ch_geoTargetGrid])
-                values.append((row, col))
-                # print "row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i]
-            except:
-                continue
-
-        return NearestNDInterpolator(np.array(points), np.array(values))
+            transformer = crsr.get_transformer(worldGeodeticSys84, geoTargetGrid)
+
+            for latlon, rowcol in json.load(_):
+                row, col = rowcol
+                clat, clon = latlon
+                try:
+                    cr_geoTargetGrid, ch_geoTargetGrid = transformer.transform(clon, clat)
+                    rowcol_to_latlon[(row, col)] = (round(clat, 4), round(clon, 4))
+                    points.append([cr_geoTargetGrid, ch_geoTargetGrid])
+                    values.append((row, col))
+                    # print "row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i]
+                except:
+                    continue
+
+            return NearestNDInterpolator(np.array(points), np.array(values)), rowcol_to_latlon
+
+    if use_index_cache:
+        options = {
+            "from_crs": crsr.get_crs(worldGeodeticSys84).to_wkt(),
+            "to_crs": crsr.get_crs(geoTargetGrid).to_wkt(),
+        }
+        interpolator, rowcol_to_latlon = load_or_create_interpolator_index(
+            path_to_latlon_to_rowcol_file, options, create, index_cache_dir
+        )
+    else:
+        interpolator, rowcol_to_latlon = create()
+    cdict.update(rowcol_to_latlon)
+    return interpolator
 
 
 def get_lat_0_lon_0_resolution_from_grid_metadata(metadata):